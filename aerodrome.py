@@ -1,22 +1,55 @@
 import os
+import asyncio
 import datetime
+import threading
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from dotenv import load_dotenv
+import http_client
+import metrics
+import price_store
+from price_cache import PriceCache
 
 load_dotenv()
 
 API_KEY = os.getenv("THEGRAPH_API_KEY")
 SUBGRAPH_ID = os.getenv("THEGRAPH_SUBGRAPH_ID")
 
-SUBGRAPH_URL = f"https://gateway.thegraph.com/api/{API_KEY}/subgraphs/id/{SUBGRAPH_ID}"
+# Overridable to point at a local stand-in (see benchmarks/fake_services.py)
+SUBGRAPH_URL = os.getenv("THEGRAPH_URL") or f"https://gateway.thegraph.com/api/{API_KEY}/subgraphs/id/{SUBGRAPH_ID}"
+# Validate queries against the introspected subgraph schema
+THEGRAPH_FETCH_SCHEMA = os.getenv("THEGRAPH_FETCH_SCHEMA", "true").lower() in ("1", "true", "yes")
 
-# Cache priceUSD keyed by (token_address, day_timestamp)
-token_day_price_cache = {}
+# Tokens per aliased tokenDayDatas query in fetch_token_day_data_many
+TOKENS_PER_QUERY = int(os.getenv("THEGRAPH_TOKENS_PER_QUERY", "20"))
+# tokenDayDatas rows per page in fetch_token_day_data_since (The Graph caps `first` at 1000)
+DAY_DATA_PAGE_SIZE = 1000
+
+# Cache priceUSD keyed by (token_address, day_timestamp), shared on disk by all workers
+token_day_price_cache = PriceCache()
+
+# Connected gql session shared by all queries so the HTTP connection is kept alive
+_session = None
+_session_lock = threading.Lock()
 
 def create_client():
-    transport = RequestsHTTPTransport(url=SUBGRAPH_URL, verify=True, retries=3)
-    return Client(transport=transport, fetch_schema_from_transport=True)
+    transport = http_client.graphql_transport(SUBGRAPH_URL)
+    return Client(transport=transport, fetch_schema_from_transport=THEGRAPH_FETCH_SCHEMA)
+
+def get_session():
+    """
+    Returns the shared connected session. The subgraph schema is fetched once
+    on connect and reused to validate every later query.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_client().connect_sync()
+    return _session
+
+def execute(query, params):
+    """Runs a query on the shared session, recorded in the upstream metrics by operation name."""
+    with metrics.track_upstream("thegraph", query.document.definitions[0].name.value):
+        return get_session().execute(query, variable_values=params)
 
 def normalize_token_address(token_address: str) -> str:
     if token_address.lower() == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
@@ -67,6 +100,73 @@ def build_token_day_data_query():
         }
     """)
 
+def build_multi_token_day_data_query(count: int):
+    variables = ", ".join(f"$token{i}: String!" for i in range(count))
+    fields = "".join(f"""
+          t{i}: tokenDayDatas(
+            first: $first,
+            where: {{ token: $token{i} }},
+            orderBy: date,
+            orderDirection: asc
+          ) {{
+            date
+            priceUSD
+          }}""" for i in range(count))
+    return gql(f"""
+        query TokenDayDatasBatch($first: Int!, {variables}) {{{fields}
+        }}
+    """)
+
+def build_token_day_data_since_query(count: int):
+    variables = ", ".join(f"$token{i}: String!, $after{i}: Int!" for i in range(count))
+    fields = "".join(f"""
+          t{i}: tokenDayDatas(
+            first: $first,
+            where: {{ token: $token{i}, date_gt: $after{i} }},
+            orderBy: date,
+            orderDirection: asc
+          ) {{
+            date
+            priceUSD
+          }}""" for i in range(count))
+    return gql(f"""
+        query TokenDayDatasSince($first: Int!, {variables}) {{{fields}
+        }}
+    """)
+
+def fetch_token_day_data_since(after_by_token):
+    """
+    Every tokenDayData newer than after_by_token[token] (a day timestamp), paging
+    through aliased queries of TOKENS_PER_QUERY tokens. Returns
+    {token: [(day, price), ...]} ascending by day; tokens whose fetch failed are left out.
+    """
+    pending = dict(after_by_token)
+    results = {token: [] for token in pending}
+    failed = set()
+    while pending:
+        chunk = sorted(pending)[:TOKENS_PER_QUERY]
+        params = {"first": DAY_DATA_PAGE_SIZE}
+        for i, token in enumerate(chunk):
+            params[f"token{i}"] = token
+            params[f"after{i}"] = pending[token]
+        try:
+            result = execute(build_token_day_data_since_query(len(chunk)), params)
+        except Exception as e:
+            print(f"[ERROR] Failed to fetch token day data for {len(chunk)} tokens: {e}")
+            failed.update(chunk)
+            for token in chunk:
+                del pending[token]
+            continue
+
+        for i, token in enumerate(chunk):
+            rows = result.get(f"t{i}", [])
+            results[token].extend((int(row["date"]), float(row.get("priceUSD") or 0)) for row in rows)
+            if len(rows) < DAY_DATA_PAGE_SIZE:
+                del pending[token]
+            else:
+                pending[token] = int(rows[-1]["date"])
+    return {token: rows for token, rows in results.items() if token not in failed}
+
 def fetch_token_day_data(token_address: str, days: int = 150):
     """
     Fetches the latest `days` tokenDayDatas from The Graph for `token_address`.
@@ -74,7 +174,6 @@ def fetch_token_day_data(token_address: str, days: int = 150):
     Returns the list of tokenDayDatas.
     """
     token_address = normalize_token_address(token_address)
-    client = create_client()
     query = build_token_day_data_query()
     params = {
         "tokenId": token_address,
@@ -83,18 +182,69 @@ def fetch_token_day_data(token_address: str, days: int = 150):
         "orderDirection": "asc"
     }
     try:
-        result = client.execute(query, variable_values=params)
+        result = execute(query, params)
         day_datas = result["tokenDayDatas"]
         # Update individual day price cache
-        for day_data in day_datas:
-            day_ts = int(day_data['date'])
-            price = float(day_data.get('priceUSD', 0))
-            token_day_price_cache[(token_address, day_ts)] = price
+        token_day_price_cache.set_many([
+            (token_address, int(day_data['date']), float(day_data.get('priceUSD', 0)))
+            for day_data in day_datas
+        ])
+        token_day_price_cache.mark_fetched(token_address)
         return day_datas
     except Exception as e:
         print(f"[ERROR] Failed to fetch token day data: {e}")
         return []
 
+def token_day_data_batches(token_addresses, days: int = 150, skip_recent: bool = True):
+    """Yields (tokens, query, params) for aliased tokenDayDatas queries of TOKENS_PER_QUERY tokens."""
+    tokens = sorted({normalize_token_address(token) for token in token_addresses})
+    if skip_recent:
+        tokens = [token for token in tokens if not token_day_price_cache.recently_fetched(token)]
+
+    for start in range(0, len(tokens), TOKENS_PER_QUERY):
+        chunk = tokens[start:start + TOKENS_PER_QUERY]
+        params = {"first": days}
+        params.update({f"token{i}": token for i, token in enumerate(chunk)})
+        yield chunk, build_multi_token_day_data_query(len(chunk)), params
+
+def save_token_day_data_batch(tokens, result):
+    for i, token in enumerate(tokens):
+        token_day_price_cache.set_many([
+            (token, int(day_data['date']), float(day_data.get('priceUSD', 0)))
+            for day_data in result.get(f"t{i}", [])
+        ])
+        token_day_price_cache.mark_fetched(token)
+
+def fetch_token_day_data_many(token_addresses, days: int = 150, skip_recent: bool = True):
+    """
+    Fetches tokenDayDatas for many tokens using aliased multi-token queries of
+    TOKENS_PER_QUERY tokens each, and fills token_day_price_cache.
+    Tokens fetched within PRICE_REFETCH_INTERVAL are skipped unless skip_recent is False.
+    """
+    for chunk, query, params in token_day_data_batches(token_addresses, days, skip_recent):
+        try:
+            result = execute(query, params)
+        except Exception as e:
+            print(f"[ERROR] Failed to fetch token day data for {len(chunk)} tokens: {e}")
+            continue
+        save_token_day_data_batch(chunk, result)
+
+async def fetch_token_day_data_many_async(token_addresses, days: int = 150, skip_recent: bool = True):
+    """fetch_token_day_data_many over an async gql session, for use inside an event loop."""
+    batches = list(token_day_data_batches(token_addresses, days, skip_recent))
+    if not batches:
+        return
+    client = Client(transport=http_client.async_graphql_transport(SUBGRAPH_URL), fetch_schema_from_transport=THEGRAPH_FETCH_SCHEMA)
+    async with client as session:
+        for chunk, query, params in batches:
+            try:
+                with metrics.track_upstream("thegraph", query.document.definitions[0].name.value):
+                    result = await session.execute(query, variable_values=params)
+            except Exception as e:
+                print(f"[ERROR] Failed to fetch token day data for {len(chunk)} tokens: {e}")
+                continue
+            save_token_day_data_batch(chunk, result)
+
 def get_token_price_at(ts_unix: int, token_address: str, lookback_days=150):
     """
     Returns priceUSD for the given token at the UTC day containing ts_unix.
@@ -104,40 +254,84 @@ def get_token_price_at(ts_unix: int, token_address: str, lookback_days=150):
     token_address = normalize_token_address(token_address)
     day_start = datetime.datetime.utcfromtimestamp(ts_unix).replace(hour=0, minute=0, second=0, microsecond=0)
     day_timestamp = int(day_start.timestamp())
-    cache_key = (token_address, day_timestamp)
 
     # Return from cache if available
-    if cache_key in token_day_price_cache:
-        print("CACHE_HIT---")
-        return token_day_price_cache[cache_key]
+    cached = token_day_price_cache.get(token_address, day_timestamp)
+    metrics.cache_lookup("price", cached is not None)
+    if cached is not None:
+        return cached
 
     # Check if it's today (UTC)
     now = datetime.datetime.utcnow()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     if day_start == today_start:
         # Fetch latest hourly data for today
-        client = create_client()
         query = build_latest_token_data_query()
         params = {"tokenId": token_address}
-        result = client.execute(query, variable_values=params)
+        result = execute(query, params)
         items = result.get("tokenHourDatas", [])
         if items:
             latest = items[0]
             price = float(latest["priceUSD"])
-            token_day_price_cache[cache_key] = price
+            token_day_price_cache.set(token_address, day_timestamp, price)
             return price
         return 0.0
     
     today_timestamp = int(today_start.timestamp())
-    today_key = (token_address, today_timestamp)
-    
-    if today_key in token_day_price_cache:
-        return token_day_price_cache[today_key]
-    # Not today → Fetch historic data and update cache
-    fetch_token_day_data(token_address, days=lookback_days)
-    return token_day_price_cache.get(cache_key, 0.0)
+    today_price = token_day_price_cache.get(token_address, today_timestamp)
 
+    if today_price is not None:
+        return today_price
+    # Not today → Fetch historic data and update cache, unless another worker just did
+    if not token_day_price_cache.recently_fetched(token_address):
+        fetch_token_day_data(token_address, days=lookback_days)
+    price = token_day_price_cache.get(token_address, day_timestamp)
+    return price if price is not None else 0.0
+
+
+# Tokens whose price history is loaded in the background at startup (WETH and native ETH)
+WARM_UP_TOKENS = [
+    "0x4200000000000000000000000000000000000006",
+    "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee",
+]
+
+# Set once the warm-up has finished (successfully or not)
+ready = threading.Event()
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+def warm_up():
+    try:
+        if price_store.PRICE_SOURCE == "store":
+            # Volume is priced from the price store; the per-day cache would go unused
+            price_store.get_store().refresh(WARM_UP_TOKENS)
+        else:
+            fetch_token_day_data_many(WARM_UP_TOKENS, 150)
+    except Exception as e:
+        print(f"[ERROR] Price warm-up failed: {e}")
+    finally:
+        ready.set()
+
+async def warm_up_async():
+    """warm_up for the ASGI app, run as a background task on its event loop."""
+    try:
+        if price_store.PRICE_SOURCE == "store":
+            await asyncio.to_thread(price_store.get_store().refresh, WARM_UP_TOKENS)
+        else:
+            await fetch_token_day_data_many_async(WARM_UP_TOKENS, 150)
+    except Exception as e:
+        print(f"[ERROR] Price warm-up failed: {e}")
+    finally:
+        ready.set()
 
+def start_warm_up():
+    """Starts the price warm-up on a daemon thread instead of blocking import."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, name="price-warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
 
-fetch_token_day_data("0x4200000000000000000000000000000000000006", 150)
-fetch_token_day_data("0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee", 150)
\ No newline at end of file
+def is_ready():
+    return ready.is_set()
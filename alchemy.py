@@ -1,13 +1,87 @@
 import os
-import requests
+import time
+import asyncio
+import threading
+import http_client
+import rate_limiter
+import label_index
+import block_index
+import metrics
+import transfer_record
+import transfer_store
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from ttl_cache import TTLCache, SingleFlight
 
 ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY")
-ALCHEMY_BASE_URL = f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
+# Overridable to point at a local stand-in (see benchmarks/fake_services.py)
+ALCHEMY_BASE_URL = os.getenv("ALCHEMY_BASE_URL") or f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 
 ETH_ADDRESS = os.getenv("ETH_ADDRESS")
 ETH_DECIMALS = 18
+
+# Block-range sharding for full-history fetches (1 = plain serial pagination)
+ALCHEMY_FETCH_SHARDS = int(os.getenv("ALCHEMY_FETCH_SHARDS", "1"))
+ALCHEMY_FETCH_CONCURRENCY = int(os.getenv("ALCHEMY_FETCH_CONCURRENCY", "4"))
+
+# timestamp -> block answers of get_block_at_timestamp
+block_at_timestamp_cache = TTLCache(maxsize=4096)
+latest_block_cache = TTLCache(maxsize=1, ttl=10)
+
+# Max calls per JSON-RPC batch array request
+ALCHEMY_BATCH_SIZE = int(os.getenv("ALCHEMY_BATCH_SIZE", "50"))
+
+# Compute-unit budget of the Alchemy plan (per second), shared through the local SQLite file by every
+# process on the host (all workers and CLI runs); 0 disables limiting
+ALCHEMY_CU_PER_SECOND = float(os.getenv("ALCHEMY_CU_PER_SECOND", "330"))
+ALCHEMY_CU_BURST = float(os.getenv("ALCHEMY_CU_BURST", "0")) or None
+# Adaptive in-flight request limit: starts at ALCHEMY_INITIAL_CONCURRENCY, grows while responses are
+# fast and shrinks on 429s or responses slower than ALCHEMY_LATENCY_TARGET seconds
+ALCHEMY_INITIAL_CONCURRENCY = int(os.getenv("ALCHEMY_INITIAL_CONCURRENCY", "8"))
+ALCHEMY_MAX_CONCURRENCY = int(os.getenv("ALCHEMY_MAX_CONCURRENCY", "32"))
+ALCHEMY_LATENCY_TARGET = float(os.getenv("ALCHEMY_LATENCY_TARGET", "5"))
+# Extra rounds a failed transfers page is re-requested (same pageKey) before pagination gives up
+ALCHEMY_PAGE_RETRIES = int(os.getenv("ALCHEMY_PAGE_RETRIES", "5"))
+# JSON-RPC error codes worth re-requesting: throttling (429, -32005 limit exceeded), internal
+# errors and the spec's -32000..-32099 server errors. Invalid params and the like fail the same way again.
+RETRYABLE_RPC_ERRORS = {429, -32005, -32603}
+
+# Compute units per call, from Alchemy's pricing table; other methods (eth_call, ...) cost 26
+COMPUTE_UNITS = {
+    "alchemy_getAssetTransfers": 150,
+    "alchemy_getTokenMetadata": 10,
+    "eth_getBlockByNumber": 16,
+    "eth_blockNumber": 10,
+}
+
+if ALCHEMY_CU_PER_SECOND > 0:
+    rate_limiter.register(rate_limiter.RateLimiter(
+        "alchemy",
+        ALCHEMY_CU_PER_SECOND,
+        COMPUTE_UNITS,
+        default_cost=26,
+        bucket=rate_limiter.SharedTokenBucket("alchemy", ALCHEMY_CU_PER_SECOND, ALCHEMY_CU_BURST),
+        concurrency=rate_limiter.ConcurrencyLimit(
+            ALCHEMY_INITIAL_CONCURRENCY, maximum=ALCHEMY_MAX_CONCURRENCY, latency_target=ALCHEMY_LATENCY_TARGET
+        ),
+    ))
+
+# /api/wallet results per wallet
+WALLET_CACHE_TTL = int(os.getenv("WALLET_CACHE_TTL", "60"))
+WALLET_CACHE_SIZE = int(os.getenv("WALLET_CACHE_SIZE", "1024"))
+# Counterparties returned per wallet
+WALLET_TOP_K = int(os.getenv("WALLET_TOP_K", "10"))
+wallet_cache = TTLCache(maxsize=WALLET_CACHE_SIZE, ttl=WALLET_CACHE_TTL)
+wallet_flights = SingleFlight()
+wallet_async_flights = {}
+wallet_fetch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("WALLET_FETCH_THREADS", "16")))
+# "live": only the latest 100 transfers per direction, fetched on every cache miss;
+# "store": the wallet's full history from the local transfer store, synced in the background
+WALLET_ANALYSIS_MODE = os.getenv("WALLET_ANALYSIS_MODE", "live")
+
 token_decimals_cache = {}
+# block number (int) -> unix timestamp
+block_timestamp_cache = {}
 
 known = {
     "0xe592427a0aece92de3edee1f18e0157c05861564": "Uniswap V3 Router",
@@ -30,88 +104,295 @@ prefix_labels = {
     "0x93": "Likely Base Network Wallet or Unknown Entity",
 }
 
+# Optional CSV/JSON label dataset merged over the built-in labels above
+LABELS_PATH = os.getenv("LABELS_PATH")
+LABELS_SNAPSHOT_PATH = os.getenv("LABELS_SNAPSHOT_PATH")
+_label_index = None
+_label_index_lock = threading.Lock()
+
+def get_label_index():
+    global _label_index
+    with _label_index_lock:
+        if _label_index is None:
+            base_entries = list(prefix_labels.items()) + list(known.items())
+            _label_index = label_index.load_index(LABELS_PATH, LABELS_SNAPSHOT_PATH, base_entries)
+    return _label_index
+
 def get_label(address):
-    address = address.lower()
-    if address in known:
-        return known[address]
-    for prefix, label in prefix_labels.items():
-        if address.startswith(prefix.lower()):
-            return label
-    return "Unknown"
-
-def analyze_wallet(wallet):
-    wallet = wallet.lower()
+    return get_label_index().label(address)
+
+def label_many(addresses):
+    return get_label_index().label_many(addresses)
+
+def analyze_wallet(wallet, start_ts=None, end_ts=None):
+    """
+    Top counterparties for `wallet`, cached for WALLET_CACHE_TTL seconds: over its
+    latest 100 transfers per direction (WALLET_ANALYSIS_MODE=live), or over its
+    full history from the local transfer store (store) once that has been synced.
+    Concurrent requests for the same wallet share a single upstream fetch.
+    start_ts/end_ts limit the scan to the blocks mined in that time range.
+    """
+    key = (wallet.lower(), start_ts, end_ts)
+    cached = wallet_cache.get(key)
+    if cached is not None:
+        return cached
+    compute = compute_wallet_history if WALLET_ANALYSIS_MODE == "store" else compute_wallet_counterparties
+    return wallet_flights.do(key, lambda: compute(*key))
+
+def compute_wallet_history(wallet, start_ts=None, end_ts=None):
+    # Wallets still syncing (or too large to store) are answered live meanwhile
+    if transfer_store.wallet_store_status(wallet) != "ready":
+        return compute_wallet_counterparties(wallet, start_ts, end_ts)
+    result = transfer_store.analyze_wallet_history(wallet, start_ts, end_ts)
+    wallet_cache.set((wallet, start_ts, end_ts), result)
+    return result
+
+def wallet_transfer_payloads(wallet, from_block, to_block):
+    """alchemy_getAssetTransfers payloads for the latest transfers sent from and to `wallet`."""
+    def payload(request_id, direction):
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": "alchemy_getAssetTransfers",
+            "params": [{
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                direction: wallet,
+                "category": ["erc20"],
+                "maxCount": "0x64",
+                "excludeZeroValue": True,
+                "order": "desc"
+            }]
+        }
+    return payload(1, "fromAddress"), payload(2, "toAddress")
+
+def summarize_counterparties(transfers_from, transfers_to):
+    """Top WALLET_TOP_K counterparties by transfer count, labelled, with per-direction counts and token totals."""
     tx_count = defaultdict(int)
+    directions = defaultdict(lambda: {"sent": 0, "received": 0})
+    tokens = defaultdict(dict)
+
+    def add(peer, tx, direction):
+        tx_count[peer] += 1
+        directions[peer][direction] += 1
+        token = (tx.get("rawContract", {}).get("address") or "").lower()
+        totals = tokens[peer].setdefault(token, {"asset": tx.get("asset"), "sent": 0.0, "received": 0.0})
+        totals[direction] += tx.get("value") or 0.0
+
+    for tx in transfers_from:
+        add(tx["to"].lower(), tx, "sent")
+
+    for tx in transfers_to:
+        add(tx["from"].lower(), tx, "received")
+
+    sorted_peers = sorted(tx_count.items(), key=lambda x: -x[1])[:WALLET_TOP_K]
+    labels = label_many([peer for peer, _ in sorted_peers])
+
+    result = []
+    for (peer, count), label in zip(sorted_peers, labels):
+        peer_type = "protocol/cex" if label != "Unknown" else "wallet"
+        result.append({
+            "counterparty": peer,
+            "tx_count": count,
+            **directions[peer],
+            "tokens": tokens[peer],
+            "type": peer_type,
+            "label": label
+        })
+    return result
+
+def compute_wallet_counterparties(wallet, start_ts=None, end_ts=None):
+    from_block, to_block = get_block_range(start_ts, end_ts)
     headers = {"Content-Type": "application/json"}
+    failed = []
 
     def fetch_transfers(params):
         try:
-            resp = requests.post(ALCHEMY_BASE_URL, json=params, headers=headers)
+            resp = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=params, headers=headers)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception as e:
+            print(f"Error fetching transfers: {e}")
+            failed.append(e)
+            return {}
+
+    payload_from, payload_to = wallet_transfer_payloads(wallet, from_block, to_block)
+    # Both directions are fetched concurrently
+    future_from = wallet_fetch_pool.submit(fetch_transfers, payload_from)
+    future_to = wallet_fetch_pool.submit(fetch_transfers, payload_to)
+    transfers_from = future_from.result().get("result", {}).get("transfers", [])
+    transfers_to = future_to.result().get("result", {}).get("transfers", [])
+    result = summarize_counterparties(transfers_from, transfers_to)
+
+    # Partial results from a failed fetch are returned but never cached
+    if not failed:
+        wallet_cache.set((wallet, start_ts, end_ts), result)
+    return result
+
+async def analyze_wallet_async(wallet, start_ts=None, end_ts=None):
+    """
+    analyze_wallet for the ASGI app: both directions are awaited on the shared
+    async HTTP client, so a worker can wait on many wallets at once. Shares
+    wallet_cache with the sync path.
+    """
+    key = (wallet.lower(), start_ts, end_ts)
+    cached = wallet_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Concurrent requests for the same wallet await one task (one event loop per worker)
+    task = wallet_async_flights.get(key)
+    if task is None:
+        if WALLET_ANALYSIS_MODE == "store":
+            coro = compute_wallet_history_async(*key)
+        else:
+            coro = compute_wallet_counterparties_async(*key)
+        task = wallet_async_flights[key] = asyncio.ensure_future(coro)
+        task.add_done_callback(lambda _: wallet_async_flights.pop(key, None))
+    return await asyncio.shield(task)
+
+async def compute_wallet_history_async(wallet, start_ts=None, end_ts=None):
+    # Only the SQLite status check and query run off the event loop; fetches stay on the async client
+    if await asyncio.to_thread(transfer_store.wallet_store_status, wallet) != "ready":
+        return await compute_wallet_counterparties_async(wallet, start_ts, end_ts)
+    result = await asyncio.to_thread(transfer_store.analyze_wallet_history, wallet, start_ts, end_ts)
+    wallet_cache.set((wallet, start_ts, end_ts), result)
+    return result
+
+async def compute_wallet_counterparties_async(wallet, start_ts=None, end_ts=None):
+    if start_ts is None and end_ts is None:
+        from_block, to_block = "0x0", "latest"
+    else:
+        # Memoized block search; the first lookup for a timestamp may take a few RPCs
+        from_block, to_block = await asyncio.to_thread(get_block_range, start_ts, end_ts)
+    headers = {"Content-Type": "application/json"}
+    failed = []
+
+    async def fetch_transfers(params):
+        try:
+            resp = await http_client.async_post(ALCHEMY_BASE_URL, service="alchemy", json=params, headers=headers)
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
             print(f"Error fetching transfers: {e}")
+            failed.append(e)
             return {}
 
-    payload_from = {
+    data_from, data_to = await asyncio.gather(*map(fetch_transfers, wallet_transfer_payloads(wallet, from_block, to_block)))
+    result = summarize_counterparties(
+        data_from.get("result", {}).get("transfers", []),
+        data_to.get("result", {}).get("transfers", []),
+    )
+
+    if not failed:
+        wallet_cache.set((wallet, start_ts, end_ts), result)
+    return result
+
+def get_latest_block_number():
+    payload = {
         "jsonrpc": "2.0",
         "id": 1,
-        "method": "alchemy_getAssetTransfers",
-        "params": [{
-            "fromBlock": "0x0",
-            "toBlock": "latest",
-            "fromAddress": wallet,
-            "category": ["erc20"],
-            "maxCount": "0x64",
-            "excludeZeroValue": True,
-            "order": "desc"
-        }]
+        "method": "eth_blockNumber",
+        "params": []
     }
-    data_from = fetch_transfers(payload_from)
-    transfers_from = data_from.get("result", {}).get("transfers", [])
+    headers = {"Content-Type": "application/json"}
+    response = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=payload, headers=headers)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch latest block number: {response.text}")
+    return int(response.json()["result"], 16)
 
-    payload_to = {
-        "jsonrpc": "2.0",
-        "id": 2,
-        "method": "alchemy_getAssetTransfers",
-        "params": [{
-            "fromBlock": "0x0",
-            "toBlock": "latest",
-            "toAddress": wallet,
-            "category": ["erc20"],
-            "maxCount": "0x64",
-            "excludeZeroValue": True,
-            "order": "desc"
-        }]
-    }
-    data_to = fetch_transfers(payload_to)
-    transfers_to = data_to.get("result", {}).get("transfers", [])
+def get_cached_latest_block_number():
+    latest = latest_block_cache.get("latest")
+    if latest is None:
+        latest = get_latest_block_number()
+        latest_block_cache.set("latest", latest)
+    return latest
 
-    for tx in transfers_from:
-        to_addr = tx["to"].lower()
-        tx_count[to_addr] += 1
+def get_block_timestamp(block_num):
+    """Exact timestamp of block_num, from the index anchors or one eth_getBlockByNumber call."""
+    index = block_index.get_index()
+    timestamp, exact = index.estimate(block_num)
+    if exact:
+        return timestamp
+    timestamp = get_block_timestamp_from_alchemy(hex(block_num))
+    if timestamp is None:
+        raise Exception(f"Failed to fetch timestamp of block {block_num}")
+    index.add_anchor(block_num, timestamp)
+    return timestamp
 
-    for tx in transfers_to:
-        from_addr = tx["from"].lower()
-        tx_count[from_addr] += 1
+def get_block_at_timestamp(ts):
+    """
+    Last block mined at or before `ts` (0 if `ts` precedes genesis), found by
+    binary searching eth_getBlockByNumber. The search starts around the block
+    index estimate, every probed block becomes an anchor, and answers are memoized.
+    """
+    cached = block_at_timestamp_cache.get(ts)
+    if cached is not None:
+        return cached
 
-    sorted_peers = sorted(tx_count.items(), key=lambda x: -x[1])[:10]
+    latest = get_cached_latest_block_number()
+    if get_block_timestamp(latest) <= ts:
+        return latest
+    lo, hi = 0, latest
+    if get_block_timestamp(lo) > ts:
+        return 0
 
-    result = []
-    for peer, count in sorted_peers:
-        label = get_label(peer)
-        peer_type = "protocol/cex" if label != "Unknown" else "wallet"
-        result.append({
-            "counterparty": peer,
-            "tx_count": count,
-            "type": peer_type,
-            "label": label
-        })
+    # Invariant: timestamp(lo) <= ts < timestamp(hi). Gallop out from the index
+    # estimate, which on Base is usually within a few blocks of the answer.
+    guess = block_index.get_index().find_block(ts)
+    if guess is not None and lo < guess < hi:
+        step = 1
+        if get_block_timestamp(guess) <= ts:
+            lo = guess
+            while guess + step < hi and get_block_timestamp(guess + step) <= ts:
+                lo = guess + step
+                step *= 2
+            hi = min(hi, guess + step)
+        else:
+            hi = guess
+            while guess - step > lo and get_block_timestamp(guess - step) > ts:
+                hi = guess - step
+                step *= 2
+            lo = max(lo, guess - step)
 
-    return result
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if get_block_timestamp(mid) <= ts:
+            lo = mid
+        else:
+            hi = mid
 
-def fetch_all_incoming_transfers(wallet):
-    transfers = []
+    block_at_timestamp_cache.set(ts, lo)
+    return lo
+
+def get_block_range(start_ts=None, end_ts=None, from_block="0x0", to_block="latest"):
+    """Translates an optional [start_ts, end_ts] time range into (fromBlock, toBlock) hex strings."""
+    if start_ts is not None:
+        from_block = hex(max(int(from_block, 16), get_block_at_timestamp(start_ts)))
+    if end_ts is not None:
+        to_block = hex(get_block_at_timestamp(end_ts))
+    return from_block, to_block
+
+def split_block_range(start_block, end_block, shards):
+    """Splits [start_block, end_block] into up to `shards` inclusive ranges, newest first."""
+    shards = max(1, min(shards, end_block - start_block + 1))
+    size = (end_block - start_block + 1) // shards
+    ranges = []
+    lo = start_block
+    for i in range(shards):
+        hi = end_block if i == shards - 1 else lo + size - 1
+        ranges.append((lo, hi))
+        lo = hi + 1
+    ranges.reverse()
+    return ranges
+
+def iter_transfer_pages(wallet, from_block="0x0", to_block="latest", start_ts=None, end_ts=None,
+                        direction="toAddress", order="desc"):
+    """
+    Yields pages of transfers to `wallet` (from it with direction="fromAddress"),
+    newest first (oldest first with order="asc"), one request per page.
+    """
+    from_block, to_block = get_block_range(start_ts, end_ts, from_block, to_block)
     page_key = None
 
     while True:
@@ -120,41 +401,146 @@ def fetch_all_incoming_transfers(wallet):
             "id": 1,
             "method": "alchemy_getAssetTransfers",
             "params": [{
-                "fromBlock": "0x0",
-                "toBlock": "latest",
-                "toAddress": wallet,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                direction: wallet,
                 "category": ["erc20", "external"],
                 "maxCount": "0x64",
                 "excludeZeroValue": True,
-                "order": "desc"
+                # blockTimestamp lets callers filter by time without an RPC per block
+                "withMetadata": True,
+                "order": order
             }]
         }
 
         if page_key:
             payload["params"][0]["pageKey"] = page_key
 
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(ALCHEMY_BASE_URL, json=payload, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"Failed to fetch transfers: {response.text}")
-
-        result = response.json().get("result", {})
-        batch_transfers = result.get("transfers", [])
-        transfers.extend(batch_transfers)
+        result = fetch_transfers_page(payload, page_key)
+        yield result.get("transfers", [])
 
         page_key = result.get("pageKey")
         if not page_key:
             break
 
+class TransferPageError(Exception):
+    """
+    A transfers page kept failing. The transfer store resumes from its cursor,
+    the last block of the last stored page, on its next sync.
+    """
+
+def is_retryable_rpc_error(error):
+    code = error.get("code") if isinstance(error, dict) else None
+    if not isinstance(code, int):
+        return False
+    return code in RETRYABLE_RPC_ERRORS or -32099 <= code <= -32000
+
+def fetch_transfers_page(payload, page_key=None):
+    """
+    The result of one alchemy_getAssetTransfers page. A page that still fails
+    after http_client's retries (transport errors, throttling or server errors)
+    is re-requested with the same pageKey, so a long pagination resumes where it
+    stopped instead of aborting or starting over. Other JSON-RPC errors fail at once.
+    """
+    headers = {"Content-Type": "application/json"}
+    for attempt in range(ALCHEMY_PAGE_RETRIES + 1):
+        response = None
+        try:
+            response = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=payload, headers=headers)
+            body = transfer_record.loads(response.content) if response.status_code == 200 else None
+        except (ValueError, *http_client.TRANSIENT_ERRORS) as e:
+            error = e
+        else:
+            if body is not None and "error" not in body:
+                return body.get("result", {})
+            error = body["error"] if body is not None else response.text
+            if response.status_code != 200 and response.status_code not in http_client.RETRY_STATUSES:
+                # Bad request or key: another attempt would fail the same way
+                break
+            if body is not None and not is_retryable_rpc_error(error):
+                break
+        if attempt < ALCHEMY_PAGE_RETRIES:
+            print(f"[WARN] Transfers page {page_key or 'first'} failed: {error}, resuming from it")
+            time.sleep(http_client.backoff_delay(attempt + http_client.HTTP_MAX_RETRIES, response))
+    raise TransferPageError(f"Failed to fetch transfers page {page_key or 'first'}: {error}")
+
+def fetch_transfers_range(wallet, from_block="0x0", to_block="latest", direction="toAddress", project=None,
+                          keep=None):
+    transfers = []
+    for batch_transfers in iter_transfer_pages(wallet, from_block, to_block, direction=direction):
+        if keep:
+            batch_transfers = filter(keep, batch_transfers)
+        transfers.extend(map(project, batch_transfers) if project else batch_transfers)
+    return transfers
+
+def fetch_all_transfers(wallet, from_block="0x0", to_block="latest", shards=None, concurrency=None,
+                        start_ts=None, end_ts=None, direction="toAddress", project=None):
+    """
+    Fetches every transfer to `wallet` (from it with direction="fromAddress")
+    in [from_block, to_block], newest first, narrowed to the blocks of
+    [start_ts, end_ts] when given. `project` maps each transfer as its page
+    arrives (e.g. to a TransferRecord), so full transfer dicts are never accumulated.
+    With more than one shard the block range is split and the shards are paged
+    through concurrently, then merged back into `order: desc`, keeping the
+    first copy of each uniqueId.
+    """
+    from_block, to_block = get_block_range(start_ts, end_ts, from_block, to_block)
+    shards = shards or ALCHEMY_FETCH_SHARDS
+    concurrency = concurrency or ALCHEMY_FETCH_CONCURRENCY
+    if shards <= 1:
+        return fetch_transfers_range(wallet, from_block, to_block, direction, project)
+
+    start_block = int(from_block, 16)
+    end_block = get_latest_block_number() if to_block == "latest" else int(to_block, 16)
+    ranges = split_block_range(start_block, end_block, shards)
+
+    # De-duplicate on the raw uniqueId before `project`, so it works whatever
+    # the shards are projected to. The shards run concurrently, hence the lock.
+    seen = set()
+    seen_lock = threading.Lock()
+
+    def first_seen(tx):
+        unique_id = tx.get("uniqueId")
+        with seen_lock:
+            if unique_id in seen:
+                return False
+            seen.add(unique_id)
+            return True
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(ranges))) as pool:
+        results = list(pool.map(
+            lambda r: fetch_transfers_range(wallet, hex(r[0]), hex(r[1]), direction, project, first_seen),
+            ranges
+        ))
+
+    # Shards are newest first and each is already desc, so concatenating keeps the order
+    transfers = []
+    for shard_transfers in results:
+        transfers.extend(shard_transfers)
     return transfers
 
+# The names from before the fetches took a direction, kept for callers that
+# only ever read transfers to the wallet
+def iter_incoming_transfer_pages(wallet, from_block="0x0", to_block="latest", start_ts=None, end_ts=None,
+                                 order="desc"):
+    return iter_transfer_pages(wallet, from_block, to_block, start_ts, end_ts, "toAddress", order)
+
+def fetch_incoming_transfers_range(wallet, from_block="0x0", to_block="latest", project=None):
+    return fetch_transfers_range(wallet, from_block, to_block, "toAddress", project)
+
+def fetch_all_incoming_transfers(wallet, from_block="0x0", to_block="latest", shards=None, concurrency=None,
+                                 start_ts=None, end_ts=None, project=None):
+    return fetch_all_transfers(wallet, from_block, to_block, shards, concurrency, start_ts, end_ts, "toAddress", project)
+
 def get_token_decimals(token_address):
     token_address = token_address.lower()
     if token_address == ETH_ADDRESS:
         return ETH_DECIMALS
 
     if token_address in token_decimals_cache:
+        metrics.cache_lookup("decimals", True)
         return token_decimals_cache[token_address]
+    metrics.cache_lookup("decimals", False)
 
     payload = {
         "jsonrpc": "2.0",
@@ -163,7 +549,7 @@ def get_token_decimals(token_address):
         "params": [token_address]
     }
     try:
-        response = requests.post(ALCHEMY_BASE_URL, json=payload)
+        response = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=payload)
         response.raise_for_status()
         data = response.json()
         decimals = data.get("result", {}).get("decimals", 18)
@@ -175,6 +561,12 @@ def get_token_decimals(token_address):
     return decimals
 
 def get_block_timestamp_from_alchemy(block_num_hex):
+    block_num = int(block_num_hex, 16)
+    if block_num in block_timestamp_cache:
+        metrics.cache_lookup("block_timestamp", True)
+        return block_timestamp_cache[block_num]
+    metrics.cache_lookup("block_timestamp", False)
+
     payload = {
         "jsonrpc": "2.0",
         "id": 1,
@@ -182,15 +574,90 @@ def get_block_timestamp_from_alchemy(block_num_hex):
         "params": [block_num_hex, False]
     }
     headers = {"Content-Type": "application/json"}
-    response = requests.post(ALCHEMY_BASE_URL, json=payload, headers=headers)
+    response = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=payload, headers=headers)
     if response.status_code != 200:
         print(f"Failed to fetch block {block_num_hex} timestamp: {response.text}")
         return None
     result = response.json().get("result")
     if result and "timestamp" in result:
         try:
-            return int(result["timestamp"], 16)
+            timestamp = int(result["timestamp"], 16)
+            block_timestamp_cache[block_num] = timestamp
+            return timestamp
         except Exception as e:
             print(f"Error parsing timestamp for block {block_num_hex}: {e}")
             return None
-    return None
\ No newline at end of file
+    return None
+
+def rpc_batch(calls, chunk_size=None):
+    """
+    Sends (method, params) calls as JSON-RPC batch arrays of up to `chunk_size`.
+    Returns the results in call order; failed calls come back as None.
+    """
+    chunk_size = chunk_size or ALCHEMY_BATCH_SIZE
+    results = [None] * len(calls)
+    headers = {"Content-Type": "application/json"}
+
+    for start in range(0, len(calls), chunk_size):
+        payload = [
+            {"jsonrpc": "2.0", "id": start + i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls[start:start + chunk_size])
+        ]
+        try:
+            response = http_client.post(ALCHEMY_BASE_URL, service="alchemy", json=payload, headers=headers)
+            response.raise_for_status()
+            for item in response.json():
+                if "result" in item:
+                    results[item["id"]] = item["result"]
+                else:
+                    print(f"Batch call {item.get('id')} failed: {item.get('error')}")
+        except Exception as e:
+            print(f"Batch request failed: {e}")
+
+    return results
+
+def prefetch_transfer_metadata(records):
+    """
+    Resolves token decimals and missing block timestamps for a page of
+    TransferRecords in batched JSON-RPC requests, filling token_decimals_cache
+    and block_timestamp_cache before the transfers are aggregated.
+    """
+    index = block_index.get_index()
+    index.record_transfer_anchors(records)
+
+    tokens = set()
+    blocks = set()
+    for record in records:
+        token_address = record.token
+        if token_address and token_address != transfer_record.ETH_ADDRESS:
+            hit = token_address in token_decimals_cache
+            metrics.cache_lookup("decimals", hit)
+            if not hit:
+                tokens.add(token_address)
+
+        block_num = record.block
+        # Blocks the index can interpolate safely need no RPC at all
+        if block_num is not None and record.timestamp is None and block_num not in block_timestamp_cache \
+                and index.needs_exact_timestamp(block_num):
+            blocks.add(block_num)
+
+    tokens = sorted(tokens)
+    blocks = [hex(block_num) for block_num in sorted(blocks)]
+    calls = [("alchemy_getTokenMetadata", [token]) for token in tokens]
+    calls += [("eth_getBlockByNumber", [block, False]) for block in blocks]
+    if not calls:
+        return
+
+    results = rpc_batch(calls)
+
+    # Failed lookups stay uncached so the per-call path can still retry them
+    for token_address, result in zip(tokens, results[:len(tokens)]):
+        if result is not None:
+            token_decimals_cache[token_address] = result.get("decimals", 18)
+
+    anchors = []
+    for block_num_hex, result in zip(blocks, results[len(tokens):]):
+        if result and "timestamp" in result:
+            block_timestamp_cache[int(block_num_hex, 16)] = int(result["timestamp"], 16)
+            anchors.append((int(block_num_hex, 16), int(result["timestamp"], 16)))
+    index.add_anchors(anchors)
@@ -0,0 +1,72 @@
+"""
+Request parsing and response building shared by app.py (Flask) and
+asgi_app.py (Quart), so both serving modes accept the same parameters and
+return the same JSON and headers. Only the framework calls differ per app.
+"""
+from datetime import datetime, timezone
+import aerodrome
+
+SECONDS_IN_DAY = 86400
+METRICS_MIMETYPE = "text/plain; version=0.0.4"
+
+
+def parse_date_arg(args, name):
+    """Unix timestamp of the YYYY-MM-DD `name` argument at 00:00 UTC, or None when absent."""
+    value = args.get(name)
+    if not value:
+        return None
+    dt = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def parse_limit_arg(args):
+    """The positive integer `limit` argument, or None when absent."""
+    value = args.get("limit")
+    if not value:
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError("limit must be a positive integer")
+    return int(value)
+
+
+def ready_status():
+    """(body, status code) for /api/ready."""
+    status = {"ready": aerodrome.is_ready()}
+    return status, 200 if status["ready"] else 503
+
+
+def volume_params(args):
+    """
+    (start_ts, end_ts, limit, wallet) for /api/volume: optional
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&limit=N, pushed down to Supabase, and
+    ?wallet=<address>|portfolio for a tracked wallet or the rollup.
+    Raises ValueError for malformed values.
+    """
+    start_ts = parse_date_arg(args, "from")
+    end_ts = parse_date_arg(args, "to")
+    limit = parse_limit_arg(args)
+    wallet = (args.get("wallet") or "").lower() or None
+    return start_ts, end_ts, limit, wallet
+
+
+def set_volume_headers(response, etag, last_modified):
+    """Validators for conditional GETs; clients always revalidate."""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def wallet_params(args):
+    """(start_ts, end_ts) for /api/wallet: optional inclusive ?from=YYYY-MM-DD&to=YYYY-MM-DD."""
+    start_ts = parse_date_arg(args, "from")
+    end_ts = parse_date_arg(args, "to")
+    if end_ts is not None:
+        end_ts += SECONDS_IN_DAY - 1
+    return start_ts, end_ts
+
+
+def backfill_job_body(job):
+    """A job as returned by /api/backfill, with the URL to poll for its status."""
+    job["status_url"] = f"/api/backfill/{job['job_id']}"
+    return job
@@ -1,7 +1,10 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+import api_common
 import supabase_client
-import usd_volume_analysis
+import backfill_jobs
 import alchemy
+import aerodrome
+import metrics
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -10,32 +13,64 @@ from dotenv import load_dotenv
 app = Flask(__name__)
 CORS(app)
 load_dotenv()
+metrics.configure_logging()
+
+# Price history loads in the background; /api/volume only needs Supabase
+aerodrome.start_warm_up()
+
+
+@app.route("/api/ready")
+def ready():
+    status, code = api_common.ready_status()
+    return jsonify(status), code
+
+@app.route("/metrics")
+def get_metrics():
+    # Prometheus text format; counters are per worker process
+    return Response(metrics.render(), mimetype=api_common.METRICS_MIMETYPE)
 
 @app.route("/api/volume")
 def get_volume():
-    # Query all rows from usd_volume
-    formatted_data = supabase_client.get_usd_volume_date()
-    return jsonify(formatted_data)
+    try:
+        start_ts, end_ts, limit, wallet = api_common.volume_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    formatted_data, etag, last_modified = supabase_client.get_usd_volume_cached(start_ts, end_ts, limit, wallet)
+    response = api_common.set_volume_headers(jsonify(formatted_data), etag, last_modified)
+    return response.make_conditional(request)
 
 
 #alchemy is used to get transaction
 @app.route("/api/wallet/<wallet>")
 def wallet(wallet):
     try:
-        data = alchemy.analyze_wallet(wallet)
+        # Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD limits the scanned blocks
+        data = alchemy.analyze_wallet(wallet, *api_common.wallet_params(request.args))
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-#backfills data in supabase for volume api    
-@app.route("/api/backfill")
+#backfills data in supabase for volume api, in the background
+@app.route("/api/backfill", methods=["GET", "POST"])
 def backfill():
+    # Optional from/to (YYYY-MM-DD, inclusive, default today) and granularity (day|week)
+    body = request.get_json(silent=True)
     try:
-        usd_volume_analysis.run_single_day()
-        return jsonify({"success": "backfill done"}), 200
-    except Exception as e:
+        job = backfill_jobs.submit_backfill(*backfill_jobs.parse_backfill_params(request.args, body))
+    except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
+    return jsonify(api_common.backfill_job_body(job)), 202
+
+
+@app.route("/api/backfill/<job_id>")
+def backfill_status(job_id):
+    job = backfill_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,96 @@
+"""
+Async (ASGI) serving mode with the same routes and JSON as app.py.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+
+Wallet lookups await Alchemy on a shared httpx.AsyncClient, so one worker keeps
+serving while hundreds of lookups wait on upstream I/O. Supabase reads and
+backfill submission keep their sync code and run off the event loop.
+"""
+import asyncio
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from dotenv import load_dotenv
+import api_common
+import supabase_client
+import backfill_jobs
+import alchemy
+import aerodrome
+import http_client
+import metrics
+
+load_dotenv()
+metrics.configure_logging()
+
+app = cors(Quart(__name__))
+
+
+@app.before_serving
+async def start_warm_up():
+    # Price history loads in the background; /api/volume only needs Supabase
+    app.add_background_task(aerodrome.warm_up_async)
+
+
+@app.after_serving
+async def close_clients():
+    await http_client.close_async_client()
+
+
+@app.route("/api/ready")
+async def ready():
+    status, code = api_common.ready_status()
+    return jsonify(status), code
+
+@app.route("/metrics")
+async def get_metrics():
+    # Prometheus text format; counters are per worker process
+    return Response(metrics.render(), mimetype=api_common.METRICS_MIMETYPE)
+
+@app.route("/api/volume")
+async def get_volume():
+    try:
+        start_ts, end_ts, limit, wallet = api_common.volume_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    formatted_data, etag, last_modified = await asyncio.to_thread(
+        supabase_client.get_usd_volume_cached, start_ts, end_ts, limit, wallet
+    )
+    response = api_common.set_volume_headers(jsonify(formatted_data), etag, last_modified)
+    return await response.make_conditional(request)
+
+
+#alchemy is used to get transaction
+@app.route("/api/wallet/<wallet>")
+async def wallet(wallet):
+    try:
+        # Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD limits the scanned blocks
+        data = await alchemy.analyze_wallet_async(wallet, *api_common.wallet_params(request.args))
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+#backfills data in supabase for volume api, in the background
+@app.route("/api/backfill", methods=["GET", "POST"])
+async def backfill():
+    # Optional from/to (YYYY-MM-DD, inclusive, default today) and granularity (day|week)
+    body = await request.get_json(silent=True)
+    try:
+        params = backfill_jobs.parse_backfill_params(request.args, body)
+        job = await asyncio.to_thread(backfill_jobs.submit_backfill, *params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(api_common.backfill_job_body(job)), 202
+
+
+@app.route("/api/backfill/<job_id>")
+async def backfill_status(job_id):
+    job = await asyncio.to_thread(backfill_jobs.get_job, job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+
+if __name__ == "__main__":
+    app.run()
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import local_db
+import usd_volume_analysis
+
+# Tasks (days or weeks) run at most this many at a time across all jobs
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+# Finished jobs kept for status lookups
+BACKFILL_JOB_HISTORY = int(os.getenv("BACKFILL_JOB_HISTORY", "100"))
+# Longest date range one job may cover
+BACKFILL_MAX_DAYS = int(os.getenv("BACKFILL_MAX_DAYS", "366"))
+# A queued or running job without progress for this many seconds (e.g. its worker
+# was restarted) is considered abandoned and can be submitted again
+BACKFILL_STALE_SECONDS = int(os.getenv("BACKFILL_STALE_SECONDS", "3600"))
+
+GRANULARITY_DAYS = {"day": 1, "week": 7}
+
+# Jobs live in the shared local SQLite file, so every gunicorn worker sees the
+# same jobs and a range is only run once on the host
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backfill_jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    tasks_total INTEGER NOT NULL,
+    tasks_done INTEGER NOT NULL DEFAULT 0,
+    tasks_failed INTEGER NOT NULL DEFAULT 0,
+    errors TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+"""
+
+# Columns added after the first release, with their definition
+ADDED_COLUMNS = {
+    # Bumped when a stale job is submitted again; its old tasks' updates are then ignored
+    "attempt": "INTEGER NOT NULL DEFAULT 1",
+}
+
+COLUMNS = ("job_id", "status", "from_date", "to_date", "granularity", "tasks_total", "tasks_done",
+           "tasks_failed", "errors", "attempt", "created_at", "finished_at")
+
+executor = ThreadPoolExecutor(max_workers=BACKFILL_WORKERS, thread_name_prefix="backfill")
+_initialized = set()
+
+
+def get_connection():
+    conn = local_db.connect()
+    if id(conn) not in _initialized:
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(backfill_jobs)")}
+        with conn:
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE backfill_jobs ADD COLUMN {column} {definition}")
+        _initialized.add(id(conn))
+    return conn
+
+
+def get_job_id(start_date, end_date, granularity):
+    key = f"{start_date.isoformat()}:{end_date.isoformat()}:{granularity}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def split_range(start_date, end_date, granularity):
+    """Inclusive [start_date, end_date] as (start_ts, end_ts) UTC task ranges of one day or week."""
+    step = timedelta(days=GRANULARITY_DAYS[granularity])
+    tasks = []
+    current = start_date
+    while current <= end_date:
+        task_end = min(current + step, end_date + timedelta(days=1))
+        tasks.append((
+            int(datetime(current.year, current.month, current.day, tzinfo=timezone.utc).timestamp()),
+            int(datetime(task_end.year, task_end.month, task_end.day, tzinfo=timezone.utc).timestamp()),
+        ))
+        current = task_end
+    return tasks
+
+
+def parse_date(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f"`{name}` must be a YYYY-MM-DD string")
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_backfill_params(args, body=None):
+    """
+    (start_date, end_date, granularity) from the query string `args` and an
+    optional JSON `body`: from/to YYYY-MM-DD (default today) and granularity.
+    Raises ValueError for anything malformed.
+    """
+    if body is not None and not isinstance(body, dict):
+        raise ValueError("JSON body must be an object")
+    params = dict(args)
+    params.update(body or {})
+    today = datetime.now(timezone.utc).date()
+    start_date = parse_date(params, "from", today)
+    end_date = parse_date(params, "to", start_date)
+    return start_date, end_date, params.get("granularity", "day")
+
+
+def submit_backfill(start_date, end_date, granularity="day"):
+    """
+    Queues a backfill of the inclusive date range, split into day or week tasks.
+    Submitting a range that is already queued or running (in any worker) returns
+    the existing job instead of starting another one. Days after today (UTC) are dropped.
+    """
+    if not isinstance(granularity, str) or granularity not in GRANULARITY_DAYS:
+        raise ValueError(f"granularity must be one of {sorted(GRANULARITY_DAYS)}")
+    today = datetime.now(timezone.utc).date()
+    if start_date > today:
+        raise ValueError("`from` must not be in the future")
+    end_date = min(end_date, today)
+    if end_date < start_date:
+        raise ValueError("`to` must not be before `from`")
+    if (end_date - start_date).days + 1 > BACKFILL_MAX_DAYS:
+        raise ValueError(f"date range must not exceed {BACKFILL_MAX_DAYS} days")
+
+    job_id = get_job_id(start_date, end_date, granularity)
+    tasks = split_range(start_date, end_date, granularity)
+    now = time.time()
+    conn = get_connection()
+    # IMMEDIATE takes the write lock up front, so two workers cannot both start the job
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT status, updated_at, attempt FROM backfill_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is not None and row[0] in ("queued", "running") and now - row[1] < BACKFILL_STALE_SECONDS:
+            conn.rollback()
+            return get_job(job_id)
+        attempt = row[2] + 1 if row is not None else 1
+        conn.execute(
+            "INSERT OR REPLACE INTO backfill_jobs "
+            "(job_id, status, from_date, to_date, granularity, tasks_total, created_at, updated_at, attempt) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, start_date.isoformat(), end_date.isoformat(), granularity, len(tasks), now, now, attempt),
+        )
+        prune_jobs(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    for start_ts, end_ts in tasks:
+        executor.submit(run_task, job_id, attempt, start_ts, end_ts)
+    return get_job(job_id)
+
+
+def run_task(job_id, attempt, start_ts, end_ts):
+    """
+    Runs one task of `attempt`. Every update is conditioned on the attempt, so a
+    task still running after its job was resubmitted cannot count towards the new one.
+    """
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE backfill_jobs SET status = 'running', updated_at = ? "
+            "WHERE job_id = ? AND attempt = ? AND status = 'queued'",
+            (time.time(), job_id, attempt),
+        )
+    error = None
+    try:
+        usd_volume_analysis.run_range(start_ts, end_ts)
+    except Exception as e:
+        print(f"[ERROR] Backfill task {job_id} {start_ts}-{end_ts} failed: {e}")
+        error = f"{datetime.fromtimestamp(start_ts, timezone.utc).date()}: {e}"
+
+    now = time.time()
+    with conn:
+        conn.execute(
+            "UPDATE backfill_jobs SET tasks_done = tasks_done + 1, tasks_failed = tasks_failed + ?, "
+            "errors = CASE WHEN ? IS NULL THEN errors ELSE json_insert(errors, '$[#]', ?) END, "
+            "updated_at = ? WHERE job_id = ? AND attempt = ?",
+            (error is not None, error, error, now, job_id, attempt),
+        )
+        conn.execute(
+            "UPDATE backfill_jobs SET status = CASE WHEN tasks_failed THEN 'failed' ELSE 'succeeded' END, "
+            "finished_at = ? WHERE job_id = ? AND attempt = ? AND tasks_done = tasks_total",
+            (now, job_id, attempt),
+        )
+
+
+def prune_jobs(conn):
+    conn.execute(
+        "DELETE FROM backfill_jobs WHERE finished_at IS NOT NULL AND job_id NOT IN ("
+        "SELECT job_id FROM backfill_jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)",
+        (BACKFILL_JOB_HISTORY,),
+    )
+
+
+def get_job(job_id):
+    row = get_connection().execute(
+        f"SELECT {', '.join(COLUMNS)} FROM backfill_jobs WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(COLUMNS, row))
+    job["from"] = job.pop("from_date")
+    job["to"] = job.pop("to_date")
+    job["errors"] = json.loads(job["errors"])
+    job["progress"] = round(job["tasks_done"] / job["tasks_total"], 4) if job["tasks_total"] else 1.0
+    return job
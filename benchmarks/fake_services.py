@@ -0,0 +1,473 @@
+"""
+Local stand-in for Alchemy (JSON-RPC), The Graph (tokenDayDatas/tokenHourDatas),
+Supabase (PostgREST) and CoinGecko (/simple/token_price), so the app can be
+exercised without network access.
+
+    python benchmarks/fake_services.py --port 8787 --latency-ms 40
+
+then point the app at it:
+
+    ALCHEMY_BASE_URL=http://127.0.0.1:8787/alchemy
+    THEGRAPH_URL=http://127.0.0.1:8787/thegraph
+    THEGRAPH_FETCH_SCHEMA=false
+    SUPABASE_URL=http://127.0.0.1:8787
+    SUPABASE_KEY=bench
+    COINGECKO_BASE_URL=http://127.0.0.1:8787/coingecko
+
+The chain is synthetic: block n is mined at GENESIS_TIMESTAMP + 2n and the head
+is the block at HEAD_TIMESTAMP. A wallet's address encodes how many transfers
+it has (see synthetic_wallet), spread evenly from TRANSFERS_START to the head,
+so 0x00000000000000000000000000000000000f4240 has 1,000,000 incoming and
+1,000,000 outgoing transfers. Every response is deterministic.
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+
+GENESIS_TIMESTAMP = 1686789347  # Base mainnet genesis
+BLOCK_TIME = 2
+HEAD_TIMESTAMP = 1767225600  # 2026-01-01T00:00:00Z
+HEAD_BLOCK = (HEAD_TIMESTAMP - GENESIS_TIMESTAMP) // BLOCK_TIME
+TRANSFERS_START = 1735689600  # 2025-01-01T00:00:00Z
+TRANSFERS_START_BLOCK = (TRANSFERS_START - GENESIS_TIMESTAMP) // BLOCK_TIME
+# Addresses below this are synthetic wallets; anything else has no transfers
+MAX_SYNTHETIC_TRANSFERS = 10 ** 8
+DEFAULT_MAX_COUNT = 1000
+SECONDS_IN_DAY = 86400
+
+USDC = "0x833589fcd6edb6e08f4c7c32d4f71b54bda02913"
+WETH = "0x4200000000000000000000000000000000000006"
+TOKENS = [USDC, WETH] + [
+    "0x" + hashlib.sha1(f"token{i}".encode()).hexdigest() for i in range(18)
+]
+
+
+def synthetic_wallet(transfer_count):
+    return f"0x{transfer_count:040x}"
+
+
+def wallet_transfer_count(address):
+    try:
+        count = int(address, 16)
+    except (TypeError, ValueError):
+        return 0
+    return count if count <= MAX_SYNTHETIC_TRANSFERS else 0
+
+
+def block_timestamp(block_num):
+    return GENESIS_TIMESTAMP + block_num * BLOCK_TIME
+
+
+def parse_block(value):
+    if value in (None, "latest", "pending", "safe", "finalized"):
+        return HEAD_BLOCK
+    if value == "earliest":
+        return 0
+    return int(value, 16)
+
+
+def token_price(token, day):
+    """Deterministic USD price of `token` on UTC day start `day`."""
+    if token == USDC:
+        return 1.0
+    base = 1 + int(token[2:6], 16) % 3000
+    return base * (1 + ((day // SECONDS_IN_DAY) % 30) / 100)
+
+
+# Alchemy compute units per method (others cost 26)
+COMPUTE_UNITS = {
+    "alchemy_getAssetTransfers": 150,
+    "alchemy_getTokenMetadata": 10,
+    "eth_getBlockByNumber": 16,
+    "eth_blockNumber": 10,
+}
+
+
+class FakeChain:
+    """Synthetic transfers, answered the way alchemy_getAssetTransfers pages them."""
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def blocks(self, count):
+        """Ascending block numbers of a wallet's `count` transfers."""
+        with self._lock:
+            blocks = self._blocks.get(count)
+            if blocks is None:
+                span = HEAD_BLOCK - TRANSFERS_START_BLOCK
+                blocks = self._blocks[count] = TRANSFERS_START_BLOCK + np.arange(count, dtype=np.int64) * span // max(count, 1)
+            return blocks
+
+    def transfer(self, wallet, count, i, incoming, with_metadata):
+        block_num = int(self.blocks(count)[i])
+        token = TOKENS[i % len(TOKENS)]
+        value = 1 + (i % 997) / 10
+        counterparty = f"0xc0ffee00{i % 500:032x}"
+        tx = {
+            "blockNum": hex(block_num),
+            "uniqueId": f"0x{count:024x}{i:038x}{int(incoming):02x}:log:0",
+            "hash": f"0x{count:024x}{i:038x}{int(incoming):02x}",
+            "from": counterparty if incoming else wallet,
+            "to": wallet if incoming else counterparty,
+            "value": value,
+            "erc721TokenId": None,
+            "erc1155Metadata": None,
+            "tokenId": None,
+            "asset": "USDC" if token == USDC else "TKN",
+            "category": "erc20",
+            "rawContract": {"value": hex(int(value * 10 ** 18)), "address": token, "decimal": "0x12"},
+        }
+        if with_metadata:
+            tx["metadata"] = {
+                "blockTimestamp": datetime.fromtimestamp(block_timestamp(block_num), timezone.utc)
+                .strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            }
+        return tx
+
+    def get_asset_transfers(self, params):
+        incoming = bool(params.get("toAddress"))
+        wallet = (params.get("toAddress") or params.get("fromAddress") or "").lower()
+        count = wallet_transfer_count(wallet)
+        blocks = self.blocks(count)
+        lo = int(np.searchsorted(blocks, parse_block(params.get("fromBlock", "0x0")), side="left"))
+        hi = int(np.searchsorted(blocks, parse_block(params.get("toBlock", "latest")), side="right"))
+        max_count = int(params.get("maxCount", hex(DEFAULT_MAX_COUNT)), 16)
+        desc = params.get("order") == "desc"
+        with_metadata = bool(params.get("withMetadata"))
+
+        # pageKey is the next transfer index to return
+        page_key = params.get("pageKey")
+        if desc:
+            start = int(page_key) if page_key else hi - 1
+            indices = range(start, max(lo, start - max_count + 1) - 1, -1)
+            next_index = start - max_count
+            more = next_index >= lo
+        else:
+            start = int(page_key) if page_key else lo
+            indices = range(start, min(hi, start + max_count))
+            next_index = start + max_count
+            more = next_index < hi
+
+        result = {"transfers": [self.transfer(wallet, count, i, incoming, with_metadata) for i in indices]}
+        if more:
+            result["pageKey"] = str(next_index)
+        return result
+
+    def rpc(self, call):
+        method = call.get("method")
+        params = call.get("params") or []
+        if method == "alchemy_getAssetTransfers":
+            result = self.get_asset_transfers(params[0])
+        elif method == "eth_blockNumber":
+            result = hex(HEAD_BLOCK)
+        elif method == "eth_getBlockByNumber":
+            block_num = parse_block(params[0])
+            if block_num > HEAD_BLOCK:
+                result = None
+            else:
+                result = {"number": hex(block_num), "timestamp": hex(block_timestamp(block_num)), "transactions": []}
+        elif method == "alchemy_getTokenMetadata":
+            result = {"decimals": 6 if params[0].lower() == USDC else 18, "symbol": "TKN", "name": "Token", "logo": None}
+        else:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32601, "message": f"Unsupported method {method}"}}
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+
+
+def token_day_datas(token, first, order_direction="asc", after=None):
+    token = token.lower()
+    start = TRANSFERS_START if after is None else max(TRANSFERS_START, after - after % SECONDS_IN_DAY + SECONDS_IN_DAY)
+    days = range(start, HEAD_TIMESTAMP, SECONDS_IN_DAY)
+    if order_direction == "desc":
+        days = reversed(days)
+    return [
+        {"date": day, "priceUSD": str(token_price(token, day)), "volumeUSD": "0"}
+        for day, _ in zip(days, range(first))
+    ]
+
+
+ALIASED_DAY_DATAS = re.compile(r"(\w+):\s*tokenDayDatas\(([^)]*)\)")
+TOKEN_VARIABLE = re.compile(r"token:\s*\$(\w+)")
+DATE_GT_VARIABLE = re.compile(r"date_gt:\s*\$(\w+)")
+
+
+def graphql(body):
+    query = body.get("query", "")
+    variables = body.get("variables") or {}
+    if "__schema" in query:
+        return {"errors": [{"message": "Introspection is not supported, set THEGRAPH_FETCH_SCHEMA=false"}]}
+
+    data = {}
+    for alias, arguments in ALIASED_DAY_DATAS.findall(query):
+        after = DATE_GT_VARIABLE.search(arguments)
+        data[alias] = token_day_datas(
+            variables[TOKEN_VARIABLE.search(arguments).group(1)],
+            variables.get("first", 100),
+            after=variables[after.group(1)] if after else None,
+        )
+    if not data and "tokenDayDatas(" in query:
+        data["tokenDayDatas"] = token_day_datas(
+            variables["tokenId"], variables.get("first", 100), variables.get("orderDirection", "asc")
+        )
+    if "tokenHourDatas(" in query:
+        hour = HEAD_TIMESTAMP - 3600
+        data["tokenHourDatas"] = [
+            {"periodStartUnix": hour, "priceUSD": str(token_price(variables["tokenId"].lower(), hour)), "volumeUSD": "0"}
+        ]
+    return {"data": data}
+
+
+def spot_prices(params):
+    """/simple/token_price answer: the head-day price of every synthetic token asked for."""
+    day = HEAD_TIMESTAMP - SECONDS_IN_DAY
+    return {
+        address: {"usd": token_price(address, day)}
+        for address in params.get("contract_addresses", "").lower().split(",") if address in TOKENS
+    }
+
+
+FILTER_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+
+
+def parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class FakePostgrest:
+    """In-memory tables answering the subset of PostgREST that supabase_client uses."""
+
+    def __init__(self):
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def seed(self, table, rows, on_conflict="date"):
+        self.upsert(table, rows, on_conflict)
+
+    def select(self, table, params):
+        filters = []
+        order = None
+        limit = offset = None
+        for key, value in params:
+            if key == "select":
+                continue
+            if key == "order":
+                column, _, direction = value.partition(".")
+                order = (column, direction.startswith("desc"))
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            else:
+                op, _, operand = value.partition(".")
+                filters.append((key, FILTER_OPS[op], parse_value(operand)))
+
+        with self._lock:
+            rows = list(self.tables.get(table, {}).values())
+        rows = [row for row in rows if all(column in row and op(row[column], operand) for column, op, operand in filters)]
+        if order is not None:
+            rows.sort(key=lambda row: row.get(order[0]), reverse=order[1])
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+        return rows
+
+    def upsert(self, table, rows, on_conflict):
+        rows = rows if isinstance(rows, list) else [rows]
+        columns = (on_conflict or "id").split(",")
+        with self._lock:
+            stored = self.tables.setdefault(table, {})
+            for row in rows:
+                key = tuple(row.get(column) for column in columns)
+                stored[key] = dict(stored.get(key, {}), **row)
+        return rows
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for hundreds of concurrent connections from async clients
+    request_queue_size = 1024
+
+
+class FakeServices:
+    """
+    All services on one threaded HTTP server, routed by path prefix
+    (/alchemy, /thegraph, /rest/v1, /coingecko). `latency` adds a per-request delay in
+    seconds, per service name. With `alchemy_cu_per_second`, Alchemy calls beyond
+    that many compute units in a one-second window get a 429. Request counts per
+    service are kept in `stats` and served at GET /_stats.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, alchemy_cu_per_second=None):
+        self.chain = FakeChain()
+        self.postgrest = FakePostgrest()
+        self.latency = dict(latency or {})
+        self.alchemy_cu_per_second = alchemy_cu_per_second
+        self._cu_window = (0, 0)
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.server = Server((host, port), self.handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables pointing the app at this server."""
+        return {
+            "ALCHEMY_BASE_URL": f"{self.url}/alchemy",
+            "THEGRAPH_URL": f"{self.url}/thegraph",
+            "THEGRAPH_FETCH_SCHEMA": "false",
+            "SUPABASE_URL": self.url,
+            "SUPABASE_KEY": "bench",
+            "COINGECKO_BASE_URL": f"{self.url}/coingecko",
+        }
+
+    def count(self, service, n=1):
+        with self._stats_lock:
+            self.stats[service] += n
+
+    def spend_compute_units(self, body):
+        """False when the call would exceed alchemy_cu_per_second in the current second."""
+        if not self.alchemy_cu_per_second:
+            return True
+        calls = body if isinstance(body, list) else [body]
+        cost = sum(COMPUTE_UNITS.get(call.get("method"), 26) for call in calls)
+        with self._stats_lock:
+            window, spent = self._cu_window
+            now = int(time.monotonic())
+            if now != window:
+                window, spent = now, 0
+            if spent + cost > self.alchemy_cu_per_second:
+                self.stats["alchemy_throttled"] += 1
+                return False
+            self._cu_window = (window, spent + cost)
+            return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this Nagle adds ~40 ms per response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_json(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"null")
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def delay(self, service):
+                services.count(service)
+                latency = services.latency.get(service, 0)
+                if latency:
+                    time.sleep(latency)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/_stats":
+                    with services._stats_lock:
+                        return self.send_json(200, dict(services.stats))
+                if parts.path.startswith("/rest/v1/"):
+                    self.delay("supabase")
+                    table = parts.path[len("/rest/v1/"):]
+                    return self.send_json(200, services.postgrest.select(table, parse_qsl(parts.query)))
+                if parts.path.startswith("/coingecko/simple/token_price/"):
+                    self.delay("coingecko")
+                    return self.send_json(200, spot_prices(dict(parse_qsl(parts.query))))
+                self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                parts = urlsplit(self.path)
+                body = self.read_json()
+                if parts.path.startswith("/alchemy"):
+                    self.delay("alchemy")
+                    if not services.spend_compute_units(body):
+                        return self.send_json(429, {"error": {"code": 429, "message": "compute units exceeded"}})
+                    if isinstance(body, list):
+                        services.count("alchemy_batch_calls", len(body))
+                        return self.send_json(200, [services.chain.rpc(call) for call in body])
+                    return self.send_json(200, services.chain.rpc(body))
+                if parts.path.startswith("/thegraph"):
+                    self.delay("thegraph")
+                    return self.send_json(200, graphql(body))
+                if parts.path.startswith("/rest/v1/"):
+                    self.delay("supabase")
+                    table = parts.path[len("/rest/v1/"):]
+                    params = dict(parse_qsl(parts.query))
+                    rows = services.postgrest.upsert(table, body, params.get("on_conflict"))
+                    return self.send_json(201, rows)
+                self.send_json(404, {"error": "not found"})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every request")
+    parser.add_argument("--alchemy-latency-ms", type=float)
+    parser.add_argument("--thegraph-latency-ms", type=float)
+    parser.add_argument("--supabase-latency-ms", type=float)
+    parser.add_argument("--coingecko-latency-ms", type=float)
+    parser.add_argument("--alchemy-cu-per-second", type=float, help="answer Alchemy calls over this budget with 429")
+    args = parser.parse_args()
+
+    latency = {}
+    for service in ("alchemy", "thegraph", "supabase", "coingecko"):
+        value = getattr(args, f"{service}_latency_ms")
+        latency[service] = (args.latency_ms if value is None else value) / 1000
+
+    services = FakeServices(args.host, args.port, latency, args.alchemy_cu_per_second)
+    print(f"Serving fake Alchemy/The Graph/Supabase at {services.url}")
+    for key, value in services.env().items():
+        print(f"  {key}={value}")
+    try:
+        services.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+End-to-end benchmarks against the local stand-in services in fake_services.py,
+so no API key or network is needed and results are repeatable.
+
+Reports, per synthetic wallet size:
+  run_backfill    cold (empty local stores) and warm (re-run) seconds, transfers/s;
+                  fails unless the vectorized aggregation matches the per-transfer loop
+  run_single_day  cold and warm seconds
+  backfill_jobs   cold and warm seconds of a /api/backfill job of day tasks run
+                  concurrently on BACKFILL_WORKERS threads; fails unless every task succeeds
+and, once:
+  /api/wallet     p50/p95/p99 latency and req/s for uncached, cached and date-ranged requests
+  /api/volume     p50/p95/p99 latency and req/s for full, ranged and conditional (304) requests
+
+Each scenario runs in a fresh interpreter with its own SQLite files, and the
+upstream request counts it caused are reported next to it.
+
+    python benchmarks/offline_benchmark.py --sizes 1000,10000 --latency-ms 20
+    python benchmarks/offline_benchmark.py --sizes 1000000 --scenarios backfill --json results.json
+    python benchmarks/offline_benchmark.py --sizes 10000 --scenarios backfill --alchemy-cu 2000
+
+--alchemy-cu makes the fake Alchemy answer calls over that compute-unit budget
+with 429 and gives the app's rate limiter the same budget; without it the
+limiter is off so the other numbers measure the app alone.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_services
+
+RESULT_MARKER = "BENCH_RESULT "
+SINGLE_DAY = date(2025, 7, 1)
+BACKFILL_JOB_RANGE = (date(2025, 4, 1), date(2025, 4, 20))
+# 2025, the run_backfill range
+BACKFILL_CHECK_RANGE = (
+    int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()),
+    int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()),
+)
+SCENARIOS = ("backfill", "single_day", "backfill_jobs", "wallet", "volume")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def latency_summary(latencies):
+    total = sum(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "req_per_s": len(latencies) / total if total else 0.0,
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def time_requests(client, paths, headers=None, expect=200):
+    latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        response = client.get(path, headers=headers or {})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != expect:
+            raise RuntimeError(f"GET {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return latency_summary(latencies)
+
+
+# Scenario bodies, run inside the child interpreter
+
+def aggregate_with(aggregate, start_ts, end_ts):
+    import usd_volume_analysis
+    pages = usd_volume_analysis.open_transfer_pages(start_ts, end_ts)
+    try:
+        return aggregate(itertools.chain.from_iterable(pages), start_ts, end_ts)
+    finally:
+        pages.close()
+
+
+def check_vectorized_aggregation(start_ts, end_ts):
+    """Fails unless the vectorized daily/weekly/monthly volume matches the per-transfer loop's."""
+    import usd_volume_analysis
+    expected = aggregate_with(usd_volume_analysis.aggregate_usd_volume_backfill, start_ts, end_ts)
+    actual = aggregate_with(usd_volume_analysis.aggregate_usd_volume_vectorized, start_ts, end_ts)
+    for name, loop, vectorized in zip(("daily", "weekly", "monthly"), expected, actual):
+        loop = {key: value for key, value in loop.items() if value}
+        vectorized = {key: value for key, value in vectorized.items() if value}
+        if loop.keys() != vectorized.keys() or not all(
+            math.isclose(loop[key], vectorized[key], rel_tol=1e-9, abs_tol=1e-6) for key in loop
+        ):
+            raise RuntimeError(f"vectorized {name} volume differs from aggregate_usd_volume_backfill")
+
+
+def child_backfill(size, requests):
+    import usd_volume_analysis
+    result = {"cold_s": timed(usd_volume_analysis.run_backfill), "warm_s": timed(usd_volume_analysis.run_backfill)}
+    check_vectorized_aggregation(*BACKFILL_CHECK_RANGE)
+    return result
+
+
+def child_single_day(size, requests):
+    import usd_volume_analysis
+    run = lambda: usd_volume_analysis.run_single_day(SINGLE_DAY)
+    return {"cold_s": timed(run), "warm_s": timed(run)}
+
+
+def child_backfill_jobs(size, requests):
+    import backfill_jobs
+
+    def run():
+        job = backfill_jobs.submit_backfill(*BACKFILL_JOB_RANGE)
+        while job["status"] in ("queued", "running"):
+            time.sleep(0.05)
+            job = backfill_jobs.get_job(job["job_id"])
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"backfill job {job['status']}: {job['errors'][:3]}")
+    return {"cold_s": timed(run), "warm_s": timed(run)}
+
+
+def child_wallet(size, requests):
+    import app
+    client = app.app.test_client()
+    wallets = [fake_services.synthetic_wallet(size + i) for i in range(requests)]
+    return {
+        "uncached": time_requests(client, [f"/api/wallet/{wallet}" for wallet in wallets]),
+        "cached": time_requests(client, [f"/api/wallet/{wallets[0]}"] * requests),
+        "date_range": time_requests(client, [
+            f"/api/wallet/{wallet}?from=2025-06-01&to=2025-06-30" for wallet in wallets
+        ]),
+    }
+
+
+def child_volume(size, requests):
+    import app
+    import supabase_client
+    client = app.app.test_client()
+
+    def uncached(path):
+        supabase_client.invalidate_volume_cache()
+        return client.get(path)
+
+    full = "/api/volume"
+    ranged = "/api/volume?from=2025-03-01&to=2025-03-31"
+    etag = client.get(full).headers["ETag"]
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        uncached(full)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "uncached": latency_summary(latencies),
+        "cached": time_requests(client, [full] * requests),
+        "ranged": time_requests(client, [ranged] * requests),
+        "conditional_304": time_requests(client, [full] * requests, headers={"If-None-Match": etag}, expect=304),
+    }
+
+
+def run_child(scenario, size, requests):
+    sys.path.insert(0, ROOT)
+    # The app reports progress on stdout; keep it out of the result line
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = globals()[f"child_{scenario}"](size, requests)
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+# Parent side
+
+def seed_volume(services):
+    rows = []
+    day = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp())
+    while day < fake_services.HEAD_TIMESTAMP:
+        rows.append({"date": day, "daily": float(day % 1000), "weekly": 0.0, "monthly": 0.0})
+        day += fake_services.SECONDS_IN_DAY
+    services.postgrest.seed("usd_volume", rows)
+
+
+def run_scenario(services, scenario, size, requests, workdir):
+    env = dict(os.environ, **services.env())
+    env.update({
+        "MASTER_WALLET": fake_services.synthetic_wallet(size),
+        "LOCAL_DB_PATH": os.path.join(workdir, "cypher.db"),
+        "PRICE_CACHE_PATH": os.path.join(workdir, "prices.db"),
+        "HTTP_MAX_RETRIES": "0",
+        "ALCHEMY_CU_PER_SECOND": str(services.alchemy_cu_per_second or 0),
+    })
+    if services.alchemy_cu_per_second:
+        # Throttled calls are part of the scenario; retry them as in production
+        del env["HTTP_MAX_RETRIES"]
+    before = dict(services.stats)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", scenario, "--child-size", str(size),
+         "--requests", str(requests)],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{scenario} ({size}) failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_MARKER):])
+    result["upstream_requests"] = {
+        service: count - before.get(service, 0)
+        for service, count in services.stats.items() if count != before.get(service, 0)
+    }
+    return result
+
+
+def print_report(results):
+    for entry in results:
+        scenario, size, result = entry["scenario"], entry["size"], entry["result"]
+        upstream = ", ".join(f"{k}={v}" for k, v in sorted(result["upstream_requests"].items()))
+        if "cold_s" in result:
+            rate = f"  {size / result['cold_s']:10.0f} transfers/s" if scenario == "backfill" else ""
+            print(f"{scenario:<11} size {size:>8}  cold {result['cold_s']:8.2f} s  warm {result['warm_s']:8.2f} s{rate}")
+        else:
+            print(f"{scenario:<11}")
+            for name, stats in result.items():
+                if name == "upstream_requests":
+                    continue
+                print(f"  {name:<16} n={stats['requests']:<5} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms"
+                      f"  p99 {stats['p99_ms']:8.2f} ms  {stats['req_per_s']:8.1f} req/s")
+        print(f"  upstream: {upstream or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated transfer counts, up to 1000000")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50, help="requests per API measurement")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every upstream request")
+    parser.add_argument("--alchemy-cu", type=float, help="Alchemy compute units per second (fake 429s + app limiter)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child, args.child_size, args.requests)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    latency = {service: args.latency_ms / 1000 for service in ("alchemy", "thegraph", "supabase", "coingecko")}
+    services = fake_services.FakeServices(latency=latency, alchemy_cu_per_second=args.alchemy_cu).start()
+    seed_volume(services)
+
+    results = []
+    try:
+        for scenario in scenarios:
+            # The API scenarios read a single page per wallet, so one size is enough
+            for size in (sizes if scenario in ("backfill", "single_day", "backfill_jobs") else sizes[:1]):
+                with tempfile.TemporaryDirectory() as workdir:
+                    result = run_scenario(services, scenario, size, args.requests, workdir)
+                results.append({"scenario": scenario, "size": size, "result": result})
+    finally:
+        services.stop()
+
+    print(f"latency per upstream request: {args.latency_ms} ms"
+          + (f", Alchemy budget {args.alchemy_cu:g} CU/s" if args.alchemy_cu else ""))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
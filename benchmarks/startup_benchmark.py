@@ -0,0 +1,55 @@
+"""
+Measures worker cold start: how long `import app` takes in a fresh interpreter,
+and how long after that the background price warm-up reports ready.
+
+    python benchmarks/startup_benchmark.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+app.aerodrome.ready.wait({timeout})
+ready = time.perf_counter() - start
+print(json.dumps({{"import": imported, "ready": ready, "warm": app.aerodrome.is_ready()}}))
+"""
+
+
+def run_once(timeout):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(timeout=timeout)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for warm-up")
+    args = parser.parse_args()
+
+    results = [run_once(args.timeout) for _ in range(args.runs)]
+    imports = [r["import"] * 1000 for r in results]
+    readies = [r["ready"] * 1000 for r in results]
+
+    print(f"runs: {args.runs}")
+    print(f"import app    median {statistics.median(imports):8.1f} ms  max {max(imports):8.1f} ms")
+    print(f"warm-up ready median {statistics.median(readies):8.1f} ms  max {max(readies):8.1f} ms")
+    print(f"warm-up completed: {sum(r['warm'] for r in results)}/{args.runs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import bisect
+import threading
+import alchemy
+import local_db
+
+# Base produces a block every 2 seconds
+BLOCK_TIME = 2
+# Interpolated timestamps within this many seconds of a UTC day boundary are fetched exactly
+DAY_BOUNDARY_MARGIN = int(os.getenv("BLOCK_INDEX_DAY_MARGIN", "600"))
+# Keep at most one anchor per this many blocks when recording them from transfers
+ANCHOR_SPACING = int(os.getenv("BLOCK_INDEX_ANCHOR_SPACING", "1800"))
+
+SECONDS_IN_DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS block_anchors (
+    block_num INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL
+);
+"""
+
+
+class BlockIndex:
+    """
+    Sparse block number -> timestamp anchors persisted in SQLite. Timestamps for
+    other blocks are interpolated between the nearest anchors.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.blocks = []
+        self.timestamps = []
+        self._lock = threading.Lock()
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        for block_num, timestamp in conn.execute("SELECT block_num, timestamp FROM block_anchors ORDER BY block_num"):
+            self.blocks.append(block_num)
+            self.timestamps.append(timestamp)
+
+    def connection(self):
+        return local_db.connect(self.path)
+
+    def add_anchors(self, anchors):
+        anchors = list(anchors)
+        if not anchors:
+            return
+        conn = self.connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO block_anchors (block_num, timestamp) VALUES (?, ?)", anchors)
+        with self._lock:
+            for block_num, timestamp in anchors:
+                i = bisect.bisect_left(self.blocks, block_num)
+                if i < len(self.blocks) and self.blocks[i] == block_num:
+                    self.timestamps[i] = timestamp
+                else:
+                    self.blocks.insert(i, block_num)
+                    self.timestamps.insert(i, timestamp)
+
+    def add_anchor(self, block_num, timestamp):
+        self.add_anchors([(block_num, timestamp)])
+
+    def record_transfer_anchors(self, records):
+        """Keeps sparse anchors from TransferRecords whose timestamp came with the transfer."""
+        anchors = []
+        last = None
+        for record in records:
+            block_num = record.block
+            if record.timestamp is None or block_num is None:
+                continue
+            if last is not None and abs(block_num - last) < ANCHOR_SPACING:
+                continue
+            if self.distance_to_anchor(block_num) < ANCHOR_SPACING:
+                continue
+            anchors.append((block_num, record.timestamp))
+            last = block_num
+        self.add_anchors(anchors)
+
+    def distance_to_anchor(self, block_num):
+        with self._lock:
+            i = bisect.bisect_left(self.blocks, block_num)
+            distances = [abs(self.blocks[j] - block_num) for j in (i - 1, i) if 0 <= j < len(self.blocks)]
+        return min(distances) if distances else float("inf")
+
+    def estimate(self, block_num):
+        """Returns (timestamp, exact) for block_num, or (None, False) without anchors."""
+        with self._lock:
+            i = bisect.bisect_left(self.blocks, block_num)
+            if i < len(self.blocks) and self.blocks[i] == block_num:
+                return self.timestamps[i], True
+            lower = (self.blocks[i - 1], self.timestamps[i - 1]) if i > 0 else None
+            upper = (self.blocks[i], self.timestamps[i]) if i < len(self.blocks) else None
+
+        if lower and upper:
+            (b0, t0), (b1, t1) = lower, upper
+            return t0 + (t1 - t0) * (block_num - b0) // (b1 - b0), False
+        if lower:
+            return lower[1] + (block_num - lower[0]) * BLOCK_TIME, False
+        if upper:
+            return upper[1] - (upper[0] - block_num) * BLOCK_TIME, False
+        return None, False
+
+    def needs_exact_timestamp(self, block_num):
+        timestamp, exact = self.estimate(block_num)
+        return not exact and (timestamp is None or near_day_boundary(timestamp))
+
+    def get_timestamp(self, block_num):
+        """
+        Interpolated timestamp for block_num. Falls back to an exact RPC fetch
+        (recorded as a new anchor) when the estimate is close to a day boundary.
+        """
+        exact = alchemy.block_timestamp_cache.get(block_num)
+        if exact is not None:
+            return exact
+        timestamp, is_exact = self.estimate(block_num)
+        if is_exact or (timestamp is not None and not near_day_boundary(timestamp)):
+            return timestamp
+
+        timestamp = alchemy.get_block_timestamp_from_alchemy(hex(block_num))
+        if timestamp is not None:
+            self.add_anchor(block_num, timestamp)
+        return timestamp
+
+    def find_block(self, timestamp):
+        """Estimated block mined at `timestamp`, binary searching the anchors; None without anchors."""
+        with self._lock:
+            i = bisect.bisect_left(self.timestamps, timestamp)
+            if i < len(self.timestamps) and self.timestamps[i] == timestamp:
+                return self.blocks[i]
+            lower = (self.blocks[i - 1], self.timestamps[i - 1]) if i > 0 else None
+            upper = (self.blocks[i], self.timestamps[i]) if i < len(self.blocks) else None
+
+        if lower and upper and upper[1] != lower[1]:
+            (b0, t0), (b1, t1) = lower, upper
+            return b0 + (b1 - b0) * (timestamp - t0) // (t1 - t0)
+        if lower:
+            return lower[0] + (timestamp - lower[1]) // BLOCK_TIME
+        if upper:
+            return max(0, upper[0] - (upper[1] - timestamp) // BLOCK_TIME)
+        return None
+
+
+def near_day_boundary(timestamp):
+    offset = timestamp % SECONDS_IN_DAY
+    return offset < DAY_BOUNDARY_MARGIN or SECONDS_IN_DAY - offset <= DAY_BOUNDARY_MARGIN
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BlockIndex()
+    return _index
@@ -1,5 +1,7 @@
 import os
-import requests
+import http_client
+import metrics
+from ttl_cache import TTLCache, SingleFlight
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
@@ -12,23 +14,76 @@ WETH_ADDRESS = os.getenv("WETH_ADDRESS")
 ETH_NORMALIZED_ADDRESS = os.getenv("ETH_NORMALIZED_ADDRESS")
 
 SECONDS_IN_A_DAY = 86400
-price_cache = {}
-
-
-def get_current_token_usd_price(contract_address: str) -> float:
+# Spot prices are reused for this many seconds; tokens CoinGecko does not know
+# (or failed lookups) are retried after COINGECKO_NEGATIVE_TTL
+COINGECKO_SPOT_TTL = int(os.getenv("COINGECKO_SPOT_TTL", "60"))
+COINGECKO_NEGATIVE_TTL = int(os.getenv("COINGECKO_NEGATIVE_TTL", "300"))
+# Contract addresses per /simple/token_price call
+COINGECKO_BATCH_SIZE = int(os.getenv("COINGECKO_BATCH_SIZE", "50"))
+COINGECKO_CACHE_SIZE = int(os.getenv("COINGECKO_CACHE_SIZE", "10000"))
+
+# (token, day) -> historic price; failed fetches are stored as 0.0 with COINGECKO_NEGATIVE_TTL
+price_cache = TTLCache(maxsize=COINGECKO_CACHE_SIZE)
+# token -> spot price
+spot_price_cache = TTLCache(maxsize=COINGECKO_CACHE_SIZE, ttl=COINGECKO_SPOT_TTL)
+spot_flights = SingleFlight()
+
+
+def fetch_spot_prices(contract_addresses):
+    """
+    One /simple/token_price/base call for up to COINGECKO_BATCH_SIZE addresses.
+    Unknown tokens and failed calls are cached as 0.0 for COINGECKO_NEGATIVE_TTL.
+    """
     url = f"{COINGECKO_BASE_URL}/simple/token_price/base"
     params = {
-        "contract_addresses": contract_address,
+        "contract_addresses": ",".join(contract_addresses),
         "vs_currencies": "usd"
     }
+    data = {}
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_client.get(url, params=params, timeout=10, service="coingecko")
         response.raise_for_status()
         data = response.json()
-        price = data.get(contract_address.lower(), {}).get("usd", 0)
-        return float(price) if price else 0.0
-    except Exception:
-        return 0.0
+    except Exception as e:
+        print(f"[ERROR] Coingecko spot price fetch for {len(contract_addresses)} tokens failed: {e}")
+
+    prices = {}
+    for address in contract_addresses:
+        price = data.get(address, {}).get("usd")
+        if price:
+            prices[address] = float(price)
+            spot_price_cache.set(address, prices[address])
+        else:
+            prices[address] = 0.0
+            spot_price_cache.set(address, 0.0, ttl=COINGECKO_NEGATIVE_TTL)
+    return prices
+
+
+def get_current_token_usd_prices(contract_addresses):
+    """
+    Spot USD prices for many tokens: cached ones are served from spot_price_cache,
+    the rest are fetched in bulk. Concurrent callers asking for the same batch
+    share one request. Returns {address: price}, 0.0 when unknown.
+    """
+    addresses = sorted({address.lower() for address in contract_addresses})
+    prices = {}
+    missing = []
+    for address in addresses:
+        price = spot_price_cache.get(address)
+        metrics.cache_lookup("coingecko_spot", price is not None)
+        if price is None:
+            missing.append(address)
+        else:
+            prices[address] = price
+
+    for start in range(0, len(missing), COINGECKO_BATCH_SIZE):
+        batch = tuple(missing[start:start + COINGECKO_BATCH_SIZE])
+        prices.update(spot_flights.do(batch, lambda: fetch_spot_prices(batch)))
+    return prices
+
+
+def get_current_token_usd_price(contract_address: str) -> float:
+    return get_current_token_usd_prices([contract_address]).get(contract_address.lower(), 0.0)
 
 
 def get_token_market_chart(token_address, days):
@@ -38,7 +93,7 @@ def get_token_market_chart(token_address, days):
         "days": days,
         "interval": "daily"
     }
-    response = requests.get(url, params=params, timeout=10)
+    response = http_client.get(url, params=params, timeout=10, service="coingecko")
     response.raise_for_status()
     return response.json()
 
@@ -55,15 +110,16 @@ def get_token_price_at(timestamp_unix, token_address):
 
     cache_key = (token_address, day_start)
 
-    if cache_key in price_cache:
-        print(f"[CACHE HIT] {cache_key}")
-        return price_cache[cache_key]
+    cached = price_cache.get(cache_key)
+    metrics.cache_lookup("coingecko_price", cached is not None)
+    if cached is not None:
+        return cached
 
-    for delta in [0, -SECONDS_IN_A_DAY, SECONDS_IN_A_DAY]:
-        candidate_key = (token_address, day_start + delta)
-        if candidate_key in price_cache:
+    for delta in [-SECONDS_IN_A_DAY, SECONDS_IN_A_DAY]:
+        candidate = price_cache.get((token_address, day_start + delta))
+        if candidate:
             print(f"Using price from day offset {delta // SECONDS_IN_A_DAY} for requested day")
-            return price_cache[candidate_key]
+            return candidate
 
     try:
         days = 90 if day_start < now_day_start else 1
@@ -72,20 +128,21 @@ def get_token_price_at(timestamp_unix, token_address):
         if "prices" in data:
             for ts_ms, price in data["prices"]:
                 day_ts = int((ts_ms // 1000) // SECONDS_IN_A_DAY * SECONDS_IN_A_DAY)
-                price_cache[(token_address, day_ts)] = price
+                price_cache.set((token_address, day_ts), price)
 
         for delta in [0, -SECONDS_IN_A_DAY, SECONDS_IN_A_DAY]:
-            candidate_key = (token_address, day_start + delta)
-            if candidate_key in price_cache:
+            candidate = price_cache.get((token_address, day_start + delta))
+            if candidate is not None:
                 if delta != 0:
                     print(f"Using price from day offset {delta // SECONDS_IN_A_DAY} for requested day")
-                return price_cache[candidate_key]
+                return candidate
 
         return 0.0
 
     except Exception as e:
         print(f"[ERROR] Coingecko price fetch failed: {e}")
-        price_cache[cache_key] = 0.0
+        # Retried once the negative entry expires instead of staying 0 forever
+        price_cache.set(cache_key, 0.0, ttl=COINGECKO_NEGATIVE_TTL)
         return 0.0
 
 
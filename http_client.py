@@ -0,0 +1,217 @@
+import os
+import random
+import asyncio
+import weakref
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from gql.transport.requests import RequestsHTTPTransport
+from dotenv import load_dotenv
+import metrics
+import rate_limiter
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "20"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+# Connections per event loop for the async client (ASGI mode)
+HTTP_ASYNC_POOL_SIZE = int(os.getenv("HTTP_ASYNC_POOL_SIZE", "100"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# One pooled keep-alive session per host, per process
+_sessions = {}
+_sessions_pid = os.getpid()
+_lock = threading.Lock()
+
+# httpx.AsyncClient per event loop; a client cannot be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+try:
+    import httpx
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+except ImportError:
+    httpx = None
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+def new_session():
+    if HTTP2_ENABLED:
+        if httpx is not None:
+            limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+            return httpx.Client(http2=True, limits=limits)
+        print("[WARN] HTTP2_ENABLED is set but httpx is not installed, using HTTP/1.1")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    global _sessions, _sessions_pid
+    host = urlsplit(url).netloc
+    with _lock:
+        if _sessions_pid != os.getpid():
+            # Never reuse sockets inherited from a parent process
+            _sessions = {}
+            _sessions_pid = os.getpid()
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = new_session()
+    return session
+
+
+def retry_after_seconds(response):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return None
+
+
+def backoff_delay(attempt, response=None):
+    """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+    if response is not None:
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return retry_after
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def operation_name(method, payload):
+    """Metrics label for a call: the JSON-RPC method, "batch" for batch arrays, else the HTTP method."""
+    if isinstance(payload, dict) and "method" in payload:
+        return payload["method"]
+    if isinstance(payload, list):
+        return "batch"
+    return method
+
+
+def request(method, url, timeout=None, retries=None, service=None, **kwargs):
+    """
+    Sends a request over the pooled session for the url's host.
+    429/5xx responses and connection errors are retried with jittered backoff;
+    the last response is returned as-is so callers keep their own status checks.
+    Every attempt is recorded in the upstream metrics under `service` (default: the host)
+    and, when a rate limiter is registered for `service`, waits for it first.
+    """
+    session = get_session(url)
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    timeout = timeout or HTTP_TIMEOUT
+    service = service or urlsplit(url).hostname
+    operation = operation_name(method, kwargs.get("json"))
+    limiter = rate_limiter.limiters.get(service)
+
+    for attempt in range(retries + 1):
+        response = None
+        sent = limiter.acquire(kwargs.get("json")) if limiter else None
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            metrics.observe_upstream(service, operation, "error", time.perf_counter() - start)
+            if limiter:
+                limiter.release(sent, None)
+            if attempt == retries:
+                raise
+            print(f"[WARN] {method} {urlsplit(url).netloc} failed: {e}, retrying")
+        except BaseException:
+            # Any other failure (decoding, bad URL, cancellation) must still free the limiter slot
+            if limiter:
+                limiter.release(sent, None)
+            raise
+        else:
+            metrics.observe_upstream(service, operation, str(response.status_code), time.perf_counter() - start)
+            if limiter:
+                limiter.release(sent, response.status_code, retry_after_seconds(response))
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        time.sleep(backoff_delay(attempt, response))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_async_client():
+    """Pooled httpx.AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=HTTP_ASYNC_POOL_SIZE, max_keepalive_connections=HTTP_ASYNC_POOL_SIZE)
+        client = _async_clients[loop] = httpx.AsyncClient(http2=HTTP2_ENABLED, limits=limits)
+    return client
+
+
+async def close_async_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def async_request(method, url, timeout=None, retries=None, service=None, **kwargs):
+    """request() for asyncio code: same retries, backoff and metrics, without blocking the loop."""
+    client = get_async_client()
+    retries = HTTP_MAX_RETRIES if retries is None else retries
+    timeout = timeout or HTTP_TIMEOUT
+    service = service or urlsplit(url).hostname
+    operation = operation_name(method, kwargs.get("json"))
+    limiter = rate_limiter.limiters.get(service)
+
+    for attempt in range(retries + 1):
+        response = None
+        sent = await limiter.acquire_async(kwargs.get("json")) if limiter else None
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TransportError as e:
+            metrics.observe_upstream(service, operation, "error", time.perf_counter() - start)
+            if limiter:
+                limiter.release(sent, None)
+            if attempt == retries:
+                raise
+            print(f"[WARN] {method} {urlsplit(url).netloc} failed: {e}, retrying")
+        except BaseException:
+            # Any other failure (decoding, bad URL, cancellation) must still free the limiter slot
+            if limiter:
+                limiter.release(sent, None)
+            raise
+        else:
+            metrics.observe_upstream(service, operation, str(response.status_code), time.perf_counter() - start)
+            if limiter:
+                limiter.release(sent, response.status_code, retry_after_seconds(response))
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        await asyncio.sleep(backoff_delay(attempt, response))
+
+
+async def async_post(url, **kwargs):
+    return await async_request("POST", url, **kwargs)
+
+
+def async_graphql_transport(url):
+    """Async gql transport (httpx) for use inside an event loop."""
+    from gql.transport.httpx import HTTPXAsyncTransport
+    return HTTPXAsyncTransport(url=url, timeout=HTTP_TIMEOUT, http2=HTTP2_ENABLED)
+
+
+def graphql_transport(url):
+    """gql transport using the same timeout/retry settings as the rest of the HTTP layer."""
+    return RequestsHTTPTransport(
+        url=url,
+        verify=True,
+        timeout=HTTP_TIMEOUT,
+        retries=HTTP_MAX_RETRIES,
+        retry_backoff_factor=HTTP_BACKOFF_BASE,
+    )
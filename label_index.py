@@ -0,0 +1,159 @@
+import os
+import csv
+import json
+import bisect
+import numpy as np
+
+UNKNOWN_LABEL = "Unknown"
+ADDRESS_LENGTH = 42  # "0x" + 40 hex chars; anything shorter is treated as a prefix
+
+
+def address_key(address):
+    """20-byte key for a full hex address, or None if it is not one."""
+    if len(address) != ADDRESS_LENGTH or not address.startswith("0x"):
+        return None
+    try:
+        return bytes.fromhex(address[2:])
+    except ValueError:
+        return None
+
+
+def read_label_file(path):
+    """Yields (address_or_prefix, label) from a CSV (address,label) or JSON file."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            data = json.load(f)
+        items = data.items() if isinstance(data, dict) else ((d["address"], d["label"]) for d in data)
+        for address, label in items:
+            yield address, label
+    else:
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[0].strip().lower() == "address":
+                    continue
+                yield row[0], row[1]
+
+
+class LabelIndex:
+    """
+    Address labels with exact matches stored as a sorted array of 20-byte keys
+    (binary searched with NumPy) and prefixes as a sorted list searched with
+    bisect for the longest matching prefix.
+    """
+
+    def __init__(self, addresses, address_label_ids, prefixes, prefix_label_ids, labels):
+        self.addresses = addresses
+        self.address_label_ids = address_label_ids
+        self.prefixes = prefixes
+        self.prefix_label_ids = prefix_label_ids
+        self.labels = labels
+
+    @classmethod
+    def build(cls, entries):
+        """Builds an index from (address_or_prefix, label) pairs; later entries win."""
+        labels = []
+        label_ids = {}
+        exact = {}
+        prefixes = {}
+        for address, label in entries:
+            address = address.strip().lower()
+            if label not in label_ids:
+                label_ids[label] = len(labels)
+                labels.append(label)
+            key = address_key(address)
+            if key is not None:
+                exact[key] = label_ids[label]
+            elif address.startswith("0x"):
+                prefixes[address] = label_ids[label]
+
+        keys = sorted(exact)
+        addresses = np.array(keys, dtype="S20") if keys else np.array([], dtype="S20")
+        address_label_ids = np.array([exact[k] for k in keys], dtype=np.uint32)
+        prefix_list = sorted(prefixes)
+        return cls(addresses, address_label_ids, prefix_list, [prefixes[p] for p in prefix_list], labels)
+
+    @classmethod
+    def load_snapshot(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["addresses"],
+                data["address_label_ids"],
+                data["prefixes"].tolist(),
+                data["prefix_label_ids"].tolist(),
+                data["labels"].tolist(),
+            )
+
+    def save_snapshot(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                addresses=self.addresses,
+                address_label_ids=self.address_label_ids,
+                prefixes=np.array(self.prefixes, dtype=str),
+                prefix_label_ids=np.array(self.prefix_label_ids, dtype=np.uint32),
+                labels=np.array(self.labels, dtype=str),
+            )
+
+    def longest_prefix(self, address):
+        """Label id of the longest stored prefix of `address`, or None."""
+        prefixes = self.prefixes
+        while address:
+            i = bisect.bisect_right(prefixes, address) - 1
+            if i < 0:
+                return None
+            candidate = prefixes[i]
+            if address.startswith(candidate):
+                return self.prefix_label_ids[i]
+            # Any matching prefix must also be a prefix of the common part
+            address = os.path.commonprefix([candidate, address])
+        return None
+
+    def label(self, address):
+        return self.label_many([address])[0]
+
+    def label_many(self, addresses):
+        addresses = [address.lower() for address in addresses]
+        results = [None] * len(addresses)
+
+        keyed = [(i, address_key(address)) for i, address in enumerate(addresses)]
+        keyed = [(i, key) for i, key in keyed if key is not None]
+        if keyed and len(self.addresses):
+            keys = np.array([key for _, key in keyed], dtype="S20")
+            positions = np.searchsorted(self.addresses, keys)
+            positions[positions == len(self.addresses)] = 0
+            found = self.addresses[positions] == keys
+            for (i, _), position, hit in zip(keyed, positions.tolist(), found.tolist()):
+                if hit:
+                    results[i] = self.labels[self.address_label_ids[position]]
+
+        for i, address in enumerate(addresses):
+            if results[i] is None:
+                label_id = self.longest_prefix(address)
+                results[i] = self.labels[label_id] if label_id is not None else UNKNOWN_LABEL
+        return results
+
+    def __len__(self):
+        return len(self.addresses) + len(self.prefixes)
+
+
+def load_index(path=None, snapshot_path=None, base_entries=()):
+    """
+    Builds the index from `base_entries` plus the label file at `path`, reusing
+    the binary snapshot when it is newer than the file.
+    """
+    if not path:
+        return LabelIndex.build(base_entries)
+
+    snapshot_path = snapshot_path or path + ".npz"
+    if os.path.exists(snapshot_path) and os.path.getmtime(snapshot_path) >= os.path.getmtime(path):
+        try:
+            return LabelIndex.load_snapshot(snapshot_path)
+        except Exception as e:
+            print(f"[WARN] Failed to load label snapshot {snapshot_path}: {e}")
+
+    index = LabelIndex.build(list(base_entries) + list(read_label_file(path)))
+    try:
+        index.save_snapshot(snapshot_path)
+    except OSError as e:
+        print(f"[WARN] Failed to write label snapshot {snapshot_path}: {e}")
+    return index
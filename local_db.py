@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local SQLite file shared by the on-disk stores (transfers, cursors, ...)
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "cypher.db")
+
+_local = threading.local()
+
+
+def connect(path=None):
+    """
+    Returns a sqlite3 connection for the current thread and process.
+    Connections are reopened after a fork so gunicorn workers never share one.
+    """
+    path = path or LOCAL_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[path] = conn
+    return conn
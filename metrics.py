@@ -0,0 +1,206 @@
+import os
+import time
+import bisect
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+# Root log level and the share of repetitive per-transfer messages that are logged
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Libraries that log a line per HTTP request at INFO
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+
+def configure_logging():
+    """Sets up the root logger; called by the entry points (apps and CLIs), never on import."""
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, logging.getLogger().level))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self.render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self.key(labels), 0)
+
+    def render_value(self, key, value):
+        return [f"{self.name}{self.format_labels(key)} {value}"]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self.key(labels), 0)
+
+    def render_value(self, key, value):
+        return [f"{self.name}{self.format_labels(key)} {value}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self.key(labels))
+            return state[2] if state else 0
+
+    def render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', repr(float(bound)))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+upstream_request_seconds = Histogram(
+    "cypher_upstream_request_seconds", "Latency of upstream API calls (per attempt)", ("service", "method")
+)
+upstream_requests_total = Counter(
+    "cypher_upstream_requests_total", "Upstream API calls (per attempt) by status", ("service", "method", "status")
+)
+cache_requests_total = Counter("cypher_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+transfers_processed_total = Counter("cypher_transfers_processed_total", "Transfers priced and added to the volume")
+transfers_skipped_total = Counter("cypher_transfers_skipped_total", "Transfers left out of the volume", ("reason",))
+pipeline_stage_seconds = Histogram(
+    "cypher_pipeline_stage_seconds", "Time spent per volume pipeline stage", ("stage",)
+)
+rate_limiter_wait_seconds = Histogram(
+    "cypher_rate_limiter_wait_seconds", "Time requests waited for a rate limiter slot and budget", ("service",)
+)
+rate_limiter_throttled_total = Counter(
+    "cypher_rate_limiter_throttled_total", "Upstream 429 responses seen by the rate limiter", ("service",)
+)
+rate_limiter_concurrency = Gauge(
+    "cypher_rate_limiter_concurrency", "Current adaptive in-flight request limit", ("service",)
+)
+
+
+def observe_upstream(service, method, status, seconds):
+    upstream_request_seconds.observe(seconds, service=service, method=method)
+    upstream_requests_total.inc(service=service, method=method, status=status)
+
+
+@contextmanager
+def track_upstream(service, method):
+    """Times an upstream call made outside http_client, recording status ok/error."""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        observe_upstream(service, method, status, time.perf_counter() - start)
+
+
+def cache_lookup(cache, hit):
+    cache_requests_total.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def timed_iter(iterable, stage):
+    """Yields from `iterable`, recording the time spent waiting for each item as `stage`."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            pipeline_stage_seconds.observe(time.perf_counter() - start, stage=stage)
+        yield item
+
+
+def log_sampled(logger, level, msg, *args):
+    """
+    Logs repetitive messages (one per transfer) at `level` for a LOG_SAMPLE_RATE
+    share of calls, or for every call when the logger is at DEBUG.
+    """
+    if logger.isEnabledFor(logging.DEBUG) or (logger.isEnabledFor(level) and random.random() < LOG_SAMPLE_RATE):
+        logger.log(level, msg, *args)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
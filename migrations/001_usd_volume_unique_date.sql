@@ -0,0 +1,20 @@
+-- One-off migration for tables filled by the old insert-based backfill.
+-- save_daily_volume upserts with on_conflict=date, which needs a unique
+-- constraint on usd_volume.date. Existing tables hold the duplicate rows
+-- that prevent adding it, so the duplicates are removed first, keeping the
+-- most recently written row of each date.
+--
+-- Run once in the Supabase SQL editor (or psql), then re-run the backfill
+-- so weekly/monthly are re-derived from the remaining daily rows.
+
+BEGIN;
+
+DELETE FROM usd_volume a
+USING usd_volume b
+WHERE a.date = b.date
+  AND a.ctid < b.ctid;
+
+ALTER TABLE usd_volume
+    ADD CONSTRAINT usd_volume_date_key UNIQUE (date);
+
+COMMIT;
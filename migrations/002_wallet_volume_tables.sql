@@ -0,0 +1,21 @@
+-- Tables written by multi_wallet.py, with the unique keys its upserts
+-- (on_conflict "wallet,date" and "date") need. Same volume columns as
+-- usd_volume: date is the UTC day start in unix seconds, weekly lives on
+-- the Monday row and monthly on the first-of-month row.
+
+CREATE TABLE IF NOT EXISTS wallet_usd_volume (
+    wallet TEXT NOT NULL,
+    date BIGINT NOT NULL,
+    daily DOUBLE PRECISION NOT NULL DEFAULT 0,
+    weekly DOUBLE PRECISION NOT NULL DEFAULT 0,
+    monthly DOUBLE PRECISION NOT NULL DEFAULT 0,
+    CONSTRAINT wallet_usd_volume_wallet_date_key UNIQUE (wallet, date)
+);
+
+CREATE TABLE IF NOT EXISTS portfolio_usd_volume (
+    date BIGINT NOT NULL,
+    daily DOUBLE PRECISION NOT NULL DEFAULT 0,
+    weekly DOUBLE PRECISION NOT NULL DEFAULT 0,
+    monthly DOUBLE PRECISION NOT NULL DEFAULT 0,
+    CONSTRAINT portfolio_usd_volume_date_key UNIQUE (date)
+);
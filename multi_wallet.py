@@ -0,0 +1,65 @@
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import supabase_client
+import usd_volume_analysis
+
+# Comma-separated wallets tracked alongside MASTER_WALLET
+TRACKED_WALLETS = [w.strip().lower() for w in os.getenv("TRACKED_WALLETS", "").split(",") if w.strip()]
+# Wallets fetched/aggregated at once. Threads rather than processes: the work is
+# I/O bound and the price, decimals and block timestamp caches are in-process,
+# so every wallet reuses what the others already looked up.
+MULTI_WALLET_WORKERS = int(os.getenv("MULTI_WALLET_WORKERS", "8"))
+
+
+def aggregate_wallet(wallet, start_ts, end_ts):
+    """Aggregates and stores one wallet's daily volume for [start_ts, end_ts); returns the daily totals."""
+    daily = usd_volume_analysis.aggregate_daily_volume(start_ts, end_ts, wallet=wallet)
+    supabase_client.save_daily_volume(daily, wallet=wallet)
+    return daily
+
+
+def run_multi_wallet(start_ts, end_ts, wallets=None, rollup=True, workers=None):
+    """
+    Aggregates every wallet (default TRACKED_WALLETS) for [start_ts, end_ts)
+    into wallet_usd_volume and, with `rollup`, writes the summed daily volume
+    into portfolio_usd_volume. Returns {wallet: daily} for the wallets that
+    succeeded; the rollup is skipped if any wallet failed so it never undercounts.
+    The portfolio is the sum over TRACKED_WALLETS, so a subset needs rollup=False.
+    """
+    wallets = list(dict.fromkeys(w.lower() for w in (wallets or TRACKED_WALLETS)))
+    if not wallets:
+        raise ValueError("No wallets given and TRACKED_WALLETS is empty")
+    if rollup and set(wallets) != set(TRACKED_WALLETS):
+        raise ValueError("The portfolio rollup needs every wallet in TRACKED_WALLETS; pass rollup=False for a subset")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers or MULTI_WALLET_WORKERS, thread_name_prefix="wallet") as pool:
+        futures = {wallet: pool.submit(aggregate_wallet, wallet, start_ts, end_ts) for wallet in wallets}
+        for wallet, future in futures.items():
+            try:
+                results[wallet] = future.result()
+            except Exception as e:
+                print(f"[ERROR] Volume aggregation for {wallet} failed: {e}")
+
+    if rollup and len(results) < len(wallets):
+        print("[WARN] Skipping portfolio rollup, not every wallet was aggregated")
+    elif rollup:
+        portfolio = defaultdict(float)
+        for daily in results.values():
+            for day, volume in daily.items():
+                portfolio[day] += volume
+        supabase_client.save_daily_volume(dict(portfolio), wallet=supabase_client.PORTFOLIO)
+
+    return results
+
+
+if __name__ == "__main__":
+    metrics.configure_logging()
+    # python multi_wallet.py [YYYY-MM-DD]  (default today, UTC)
+    target_day = datetime.strptime(sys.argv[1], "%Y-%m-%d").date() if len(sys.argv) > 1 else date.today()
+    start_ts = int(datetime(target_day.year, target_day.month, target_day.day, tzinfo=timezone.utc).timestamp())
+    run_multi_wallet(start_ts, start_ts + usd_volume_analysis.SECONDS_IN_DAY)
@@ -0,0 +1,47 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+def prefetch(iterable, depth=1):
+    """
+    Iterates `iterable` on a background thread, keeping up to `depth` items
+    ready ahead of the consumer (e.g. fetching the next page while the current
+    one is priced). Closing the returned generator stops the producer after the
+    item it is working on.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,106 @@
+import os
+import time
+import datetime
+import local_db
+from ttl_cache import TTLCache
+
+# Defaults to the shared local SQLite file; all workers read and write the same rows
+PRICE_CACHE_PATH = os.getenv("PRICE_CACHE_PATH") or local_db.LOCAL_DB_PATH
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "50000"))
+# Seconds before today's (still moving) price is refetched
+PRICE_TODAY_TTL = int(os.getenv("PRICE_TODAY_TTL", "300"))
+# Seconds before a token's day history is requested from The Graph again
+PRICE_REFETCH_INTERVAL = int(os.getenv("PRICE_REFETCH_INTERVAL", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_day_prices (
+    token TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    price REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (token, day)
+);
+CREATE TABLE IF NOT EXISTS token_price_fetches (
+    token TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def today_start_ts():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return int(now.timestamp()) // 86400 * 86400
+
+
+class PriceCache:
+    """
+    priceUSD keyed by (token, day_timestamp), backed by SQLite with an in-memory LRU in front.
+    Past days never expire; today's price expires after `today_ttl` seconds.
+    """
+
+    def __init__(self, path=PRICE_CACHE_PATH, maxsize=PRICE_CACHE_MAX_ENTRIES, today_ttl=PRICE_TODAY_TTL):
+        self.path = path
+        self.today_ttl = today_ttl
+        self.memory = TTLCache(maxsize=maxsize)
+        self._initialized = set()
+
+    def connection(self):
+        conn = local_db.connect(self.path)
+        if id(conn) not in self._initialized:
+            conn.executescript(SCHEMA)
+            self._initialized.add(id(conn))
+        return conn
+
+    def ttl_for(self, day, updated_at):
+        if day < today_start_ts():
+            return None
+        return self.today_ttl - (time.time() - updated_at)
+
+    def get(self, token, day):
+        """Returns the cached price or None when missing or expired."""
+        key = (token, day)
+        price = self.memory.get(key)
+        if price is not None:
+            return price
+
+        row = self.connection().execute(
+            "SELECT price, updated_at FROM token_day_prices WHERE token = ? AND day = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        price, updated_at = row
+        ttl = self.ttl_for(day, updated_at)
+        if ttl is not None and ttl <= 0:
+            return None
+        self.memory.set(key, price, ttl=ttl)
+        return price
+
+    def set(self, token, day, price):
+        self.set_many([(token, day, price)])
+
+    def set_many(self, items):
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO token_day_prices (token, day, price, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(token, day) DO UPDATE SET price = excluded.price, updated_at = excluded.updated_at",
+                [(token, day, price, now) for token, day, price in items],
+            )
+        for token, day, price in items:
+            self.memory.set((token, day), price, ttl=self.ttl_for(day, now))
+
+    def mark_fetched(self, token):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO token_price_fetches (token, fetched_at) VALUES (?, ?) "
+                "ON CONFLICT(token) DO UPDATE SET fetched_at = excluded.fetched_at",
+                (token, time.time()),
+            )
+
+    def recently_fetched(self, token, interval=PRICE_REFETCH_INTERVAL):
+        row = self.connection().execute(
+            "SELECT fetched_at FROM token_price_fetches WHERE token = ?", (token,)
+        ).fetchone()
+        return row is not None and time.time() - row[0] < interval
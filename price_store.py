@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+import numpy as np
+import aerodrome
+
+# "store": volume is priced by as-of joins against this store; "subgraph": per-day price cache (aerodrome)
+PRICE_SOURCE = os.getenv("PRICE_SOURCE", "store")
+# One <token>.npy file of (day, price) per token; shared by every worker on the host
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", "price_store")
+# Seconds before a token's history is checked with The Graph for newer days
+PRICE_STORE_REFRESH_INTERVAL = int(os.getenv("PRICE_STORE_REFRESH_INTERVAL", "3600"))
+# A transfer takes the price of the nearest earlier day at most this many days back, else 0
+PRICE_STORE_MAX_GAP_DAYS = int(os.getenv("PRICE_STORE_MAX_GAP_DAYS", "7"))
+
+SECONDS_IN_DAY = 86400
+
+DTYPE = np.dtype([("day", "<i8"), ("price", "<f8")])
+EMPTY = np.zeros(0, dtype=DTYPE)
+
+
+class PriceStore:
+    """
+    Daily priceUSD history per token as memory-mapped NumPy arrays sorted by day.
+    Files only grow by the days The Graph has published since the last refresh
+    and are replaced atomically, so readers never see a partial write.
+    """
+
+    def __init__(self, directory=PRICE_STORE_DIR, refresh_interval=PRICE_STORE_REFRESH_INTERVAL,
+                 max_gap_days=PRICE_STORE_MAX_GAP_DAYS):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.max_gap = max_gap_days * SECONDS_IN_DAY
+        self._arrays = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, token):
+        return os.path.join(self.directory, f"{token}.npy")
+
+    def load(self, token):
+        """The token's (day, price) history; reloaded when another process replaced the file."""
+        path = self.path(token)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return EMPTY
+        with self._lock:
+            cached = self._arrays.get(token)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            history = np.load(path, mmap_mode="r")
+        except ValueError:
+            # An empty history has no data to map
+            history = np.load(path)
+        with self._lock:
+            self._arrays[token] = (mtime, history)
+        return history
+
+    def save(self, token, history):
+        path = self.path(token)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, history)
+        os.replace(tmp_path, path)
+
+    def refresh(self, tokens, force=False):
+        """
+        Appends the days newer than each token's last stored day. Tokens whose
+        file was written within refresh_interval seconds (by any worker) are skipped.
+        """
+        now = time.time()
+        with self._refresh_lock:
+            due = {}
+            for token in set(tokens):
+                path = self.path(token)
+                if not force and os.path.exists(path) and now - os.path.getmtime(path) < self.refresh_interval:
+                    continue
+                history = self.load(token)
+                # The last stored day is requested again: its price moves until the day closes
+                due[token] = int(history["day"][-1]) - 1 if len(history) else 0
+            if not due:
+                return
+
+            fetched = aerodrome.fetch_token_day_data_since(due)
+            for token, rows in fetched.items():
+                history = self.load(token)
+                kept = history[history["day"] <= due[token]]
+                self.save(token, np.concatenate([kept, np.array(rows, dtype=DTYPE)]))
+            print(f"Refreshed price history for {len(fetched)} of {len(due)} tokens")
+
+    def prices_asof(self, tokens, timestamps):
+        """
+        Vectorized as-of join: the price of each token on the nearest stored day
+        at or before its timestamp, or 0 when there is none within max_gap.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        days = timestamps - timestamps % SECONDS_IN_DAY
+        prices = np.zeros(len(days))
+        if len(days) == 0:
+            return prices
+        keys, inverse = np.unique(np.asarray(tokens, dtype=object), return_inverse=True)
+        for i, token in enumerate(keys.tolist()):
+            history = self.load(token)
+            if len(history) == 0:
+                continue
+            rows = inverse == i
+            token_days = days[rows]
+            idx = np.searchsorted(history["day"], token_days, side="right") - 1
+            found = idx >= 0
+            idx = np.where(found, idx, 0)
+            if self.max_gap:
+                found &= token_days - history["day"][idx] <= self.max_gap
+            prices[rows] = np.where(found, history["price"][idx], 0.0)
+        return prices
+
+    def price_at(self, token, ts_unix):
+        return float(self.prices_asof([token], [ts_unix])[0])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PriceStore()
+    return _store
@@ -0,0 +1,236 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import local_db
+import metrics
+
+# Seconds between checks for a free slot while an async caller waits
+ASYNC_POLL_INTERVAL = 0.01
+# SQLite file holding the shared token buckets; every process on the host draws from the same budget
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH") or local_db.LOCAL_DB_PATH
+
+BUCKET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# service -> RateLimiter consulted by http_client for every attempt
+limiters = {}
+
+
+class TokenBucket:
+    """
+    Refills `rate` units per second up to `capacity`. reserve() always takes the
+    units, letting the balance go negative, and returns how long the caller must
+    wait before sending, so waiters are served in order without a lock held while sleeping.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        """Empties the bucket so nothing is sent for `seconds` (e.g. a 429's Retry-After)."""
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SharedTokenBucket:
+    """
+    TokenBucket whose balance lives in SQLite, so all gunicorn/uvicorn workers and
+    CLI runs on the host share one budget instead of each spending the full rate.
+    Each reservation is one short write transaction on a connection of its own,
+    outside whatever transaction the calling thread has open on local_db.
+    """
+
+    def __init__(self, name, rate, capacity=None, path=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.path = path or RATE_LIMIT_DB_PATH
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit, so the explicit BEGIN IMMEDIATE below is the only transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(BUCKET_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _update(self, take):
+        """Refills the balance, applies take(tokens) -> tokens and returns the new balance."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+            tokens = take(tokens)
+            conn.execute(
+                "INSERT INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return tokens
+
+    def reserve(self, cost):
+        tokens = self._update(lambda tokens: tokens - cost)
+        return max(0.0, -tokens / self.rate)
+
+    def pause(self, seconds):
+        self._update(lambda tokens: min(tokens, -seconds * self.rate))
+
+
+class ConcurrencyLimit:
+    """
+    In-flight request cap adjusted AIMD-style: +1 per limit's worth of fast
+    successes, halved on throttling, and cut by `latency_backoff` when a response
+    is slower than `latency_target`. One decrease per congestion event: responses
+    to requests sent before the last decrease are ignored.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, latency_target=None, latency_backoff=0.9):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.latency_backoff = latency_backoff
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+    def abandon(self):
+        """Gives back a slot without feeding the limit, for a request that was never sent."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, started, seconds, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            slow = self.latency_target is not None and seconds > self.latency_target
+            if throttled or slow:
+                if started >= self.last_decrease:
+                    factor = 0.5 if throttled else self.latency_backoff
+                    self.limit = max(self.minimum, self.limit * factor)
+                    self.last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """
+    Compute-unit token bucket plus adaptive concurrency for one upstream service.
+    `costs` maps JSON-RPC methods to their unit cost; batch arrays cost the sum of their calls.
+    `bucket` replaces the in-process TokenBucket (e.g. with a SharedTokenBucket).
+    The concurrency limit is always per process.
+    """
+
+    def __init__(self, service, units_per_second, costs, default_cost=1, burst=None, concurrency=None,
+                 bucket=None):
+        self.service = service
+        self.costs = costs
+        self.default_cost = default_cost
+        self.bucket = bucket or TokenBucket(units_per_second, burst)
+        self.concurrency = concurrency
+
+    def cost(self, payload):
+        calls = payload if isinstance(payload, list) else [payload]
+        return sum(
+            self.costs.get(call.get("method"), self.default_cost) if isinstance(call, dict) else self.default_cost
+            for call in calls
+        )
+
+    def acquire(self, payload):
+        """Blocks until a slot and the payload's units are available; returns the start time for release()."""
+        start = time.monotonic()
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        try:
+            wait = self.bucket.reserve(self.cost(payload))
+            if wait:
+                time.sleep(wait)
+        except BaseException:
+            if self.concurrency is not None:
+                self.concurrency.abandon()
+            raise
+        metrics.rate_limiter_wait_seconds.observe(time.monotonic() - start, service=self.service)
+        return time.monotonic()
+
+    async def acquire_async(self, payload):
+        start = time.monotonic()
+        if self.concurrency is not None:
+            await self.concurrency.acquire_async()
+        try:
+            # A shared bucket is a SQLite write; keep it off the event loop
+            wait = await asyncio.to_thread(self.bucket.reserve, self.cost(payload))
+            if wait:
+                await asyncio.sleep(wait)
+        except BaseException:
+            # Cancelled while waiting for budget: the slot was never used
+            if self.concurrency is not None:
+                self.concurrency.abandon()
+            raise
+        metrics.rate_limiter_wait_seconds.observe(time.monotonic() - start, service=self.service)
+        return time.monotonic()
+
+    def release(self, started, status, retry_after=None):
+        """Feeds the outcome of a request sent at `started` back into the limits."""
+        throttled = status == 429
+        if throttled:
+            metrics.rate_limiter_throttled_total.inc(service=self.service)
+            self.bucket.pause(retry_after or 1.0)
+        if self.concurrency is None:
+            return
+        if status is None:
+            # No response (connection error, decoding error, cancellation): nothing to learn from
+            self.concurrency.abandon()
+        else:
+            self.concurrency.release(started, time.monotonic() - started, throttled)
+            metrics.rate_limiter_concurrency.set(self.concurrency.limit, service=self.service)
+
+
+def register(limiter):
+    limiters[limiter.service] = limiter
+    return limiter
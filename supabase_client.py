@@ -1,7 +1,15 @@
 from supabase import create_client, Client
 import os
+import json
+import time
+import hashlib
+import calendar
 import datetime
+import threading
+from collections import defaultdict
 from dotenv import load_dotenv
+from ttl_cache import TTLCache
+import metrics
 
 load_dotenv()
 
@@ -9,49 +17,215 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
  # Use service_role key for write access
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+SECONDS_IN_DAY = 86400
+UPSERT_CHUNK_SIZE = int(os.getenv("SUPABASE_UPSERT_CHUNK_SIZE", "500"))
+# PostgREST caps responses at 1000 rows by default
+FETCH_PAGE_SIZE = 1000
+# Series name of the rollup over all tracked wallets
+PORTFOLIO = "portfolio"
+# /api/volume responses are cached in-process; writes from this process clear
+# the cache, the TTL bounds staleness after writes from other workers
+VOLUME_CACHE_TTL = int(os.getenv("VOLUME_CACHE_TTL", "300"))
 
-def get_usd_volume_date():
-    response = supabase.table("usd_volume").select("*").execute()
-    data = response.data
+volume_cache = TTLCache(maxsize=256, ttl=VOLUME_CACHE_TTL)
+# (etag, last_modified) per query, kept past cache expiry so Last-Modified stays stable
+volume_etags = TTLCache(maxsize=256)
 
-    # Convert date unix timestamp to YYYY-MM-DD string
-    formatted_data = []
-    for row in data:
-        dt_str = datetime.datetime.utcfromtimestamp(row["date"]).strftime("%Y-%m-%d")
-        formatted_data.append({
-            "date": dt_str,
-            "daily": float(row.get("daily") or 0),
-            "weekly": float(row.get("weekly") or 0),
-            "monthly": float(row.get("monthly") or 0),
-        })
+# The client is created on first use so importing this module stays cheap
+_supabase: Client = None
+_supabase_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def get_client() -> Client:
+    global _supabase
+    with _supabase_lock:
+        if _supabase is None:
+            _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+
+def volume_table(wallet=None):
+    """
+    (table, filters, conflict columns) for a volume series: the master wallet
+    (None), PORTFOLIO (rollup of tracked wallets) or a single tracked wallet.
+    """
+    if wallet is None:
+        return "usd_volume", {}, "date"
+    if wallet == PORTFOLIO:
+        return "portfolio_usd_volume", {}, "date"
+    return "wallet_usd_volume", {"wallet": wallet.lower()}, "wallet,date"
+
+def select_volume(wallet=None):
+    table, filters, _ = volume_table(wallet)
+    query = get_client().table(table).select("date,daily,weekly,monthly")
+    for column, value in filters.items():
+        query = query.eq(column, value)
+    return query
+
+def execute(query, method):
+    with metrics.track_upstream("supabase", method):
+        return query.execute()
+
+def format_volume_row(row):
+    return {
+        "date": time.strftime("%Y-%m-%d", time.gmtime(row["date"])),
+        "daily": float(row.get("daily") or 0),
+        "weekly": float(row.get("weekly") or 0),
+        "monthly": float(row.get("monthly") or 0),
+    }
+
+def get_usd_volume_date(start_ts=None, end_ts=None, limit=None, wallet=None):
+    """
+    Volume rows with start_ts <= date <= end_ts, ascending by date. Filtering,
+    projection and ordering are pushed down to Supabase; with `limit` only the
+    most recent `limit` rows are returned.
+    """
+    query = select_volume(wallet)
+    if start_ts is not None:
+        query = query.gte("date", start_ts)
+    if end_ts is not None:
+        query = query.lte("date", end_ts)
+
+    if limit:
+        data = execute(query.order("date", desc=True).limit(limit), "select").data
+        data.reverse()
+    else:
+        data = []
+        offset = 0
+        while True:
+            page = execute(query.order("date").range(offset, offset + FETCH_PAGE_SIZE - 1), "select").data
+            data.extend(page)
+            if len(page) < FETCH_PAGE_SIZE:
+                break
+            offset += FETCH_PAGE_SIZE
+
+    return [format_volume_row(row) for row in data]
+
+def get_usd_volume_cached(start_ts=None, end_ts=None, limit=None, wallet=None):
+    """
+    Cached get_usd_volume_date returning (data, etag, last_modified).
+    The ETag is a hash of the payload, so it is stable across workers, and
+    last_modified only moves when the payload actually changes.
+    """
+    key = (start_ts, end_ts, limit, wallet)
+    cached = volume_cache.get(key)
+    if cached is not None:
+        return cached
+
+    data = get_usd_volume_date(start_ts, end_ts, limit, wallet)
+    etag = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    previous = volume_etags.get(key)
+    if previous is not None and previous[0] == etag:
+        last_modified = previous[1]
+    else:
+        last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        volume_etags.set(key, (etag, last_modified))
+
+    result = (data, etag, last_modified)
+    volume_cache.set(key, result)
+    return result
 
-    # Sort by date ascending
-    formatted_data.sort(key=lambda x: x["date"])
-    return formatted_data
+def invalidate_volume_cache():
+    volume_cache.clear()
 
-def save_volume_to_db(daily, weekly, monthly):
-    # Combine all dates
-    all_dates = set(daily) | set(weekly) | set(monthly)
+def get_week_start(day_ts):
+    """Monday 00:00 UTC of the week containing day_ts (1970-01-01 was a Thursday)."""
+    return day_ts - ((day_ts // SECONDS_IN_DAY + 3) % 7) * SECONDS_IN_DAY
 
-    # Delete all previous rows (optional, if you want to clear old data)
-    #supabase.table("usd_volume").delete().neq("date", 0).execute()
+def get_month_start(day_ts):
+    dt = datetime.datetime.fromtimestamp(day_ts, datetime.timezone.utc)
+    return calendar.timegm(dt.replace(day=1).timetuple())
 
-    # Insert each row
+def get_next_month_start(day_ts):
+    month_start = get_month_start(day_ts)
+    dt = datetime.datetime.fromtimestamp(month_start, datetime.timezone.utc)
+    return get_month_start(month_start + calendar.monthrange(dt.year, dt.month)[1] * SECONDS_IN_DAY)
+
+def fetch_volume_rows(start_ts, end_ts, wallet=None):
+    """Stored volume rows with start_ts <= date < end_ts, paged past the PostgREST row limit."""
     rows = []
-    for date in sorted(all_dates):
-        rows.append({
-            "date": date,
-            "daily": daily.get(date, 0),
-            "weekly": weekly.get(date, 0),
-            "monthly": monthly.get(date, 0)
-        })
-
-    # Supabase allows bulk insert
-    if rows:
-        response = supabase.table("usd_volume").insert(rows).execute()
+    offset = 0
+    while True:
+        response = execute(
+            select_volume(wallet)
+            .gte("date", start_ts)
+            .lt("date", end_ts)
+            .order("date")
+            .range(offset, offset + FETCH_PAGE_SIZE - 1),
+            "select",
+        )
+        rows.extend(response.data)
+        if len(response.data) < FETCH_PAGE_SIZE:
+            return rows
+        offset += FETCH_PAGE_SIZE
+
+def upsert_volume_rows(rows, wallet=None):
+    """Upserts rows keyed on `date` (and `wallet`) in chunks, so re-running a day never duplicates it."""
+    table, filters, on_conflict = volume_table(wallet)
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = [dict(row, **filters) for row in rows[start:start + UPSERT_CHUNK_SIZE]]
+        response = execute(get_client().table(table).upsert(chunk, on_conflict=on_conflict), "upsert")
+        invalidate_volume_cache()
         if not response.data:
-            print("Error inserting to Supabase:", response)
+            print("Error upserting to Supabase:", response)
         else:
-            print(f"Inserted {len(rows)} rows into Supabase.")
+            print(f"Upserted {len(chunk)} rows into Supabase.")
+
+def save_daily_volume(daily, wallet=None):
+    """
+    Upserts the given daily totals, keyed by UTC day start, for the master
+    wallet or the series named by `wallet` (see volume_table).
+    Weekly totals (stored on the Monday row) and monthly totals (stored on the
+    first-of-month row) are re-derived from the stored daily rows of the affected
+    weeks and months only, instead of re-aggregating transfer history.
+    """
+    if not daily:
+        return
+
+    # Parallel backfill tasks may touch the same week/month rows
+    with _write_lock, metrics.pipeline_stage_seconds.time(stage="save"):
+        _save_daily_volume(daily, wallet)
+
+def _save_daily_volume(daily, wallet):
+    days = sorted(daily)
+    window_start = min(get_week_start(days[0]), get_month_start(days[0]))
+    window_end = max(get_week_start(days[-1]) + 7 * SECONDS_IN_DAY, get_next_month_start(days[-1]))
+
+    rows = {}
+    for row in fetch_volume_rows(window_start, window_end, wallet):
+        rows[row["date"]] = {
+            "date": row["date"],
+            "daily": float(row.get("daily") or 0),
+            "weekly": float(row.get("weekly") or 0),
+            "monthly": float(row.get("monthly") or 0),
+        }
+
+    def row_for(date):
+        return rows.setdefault(date, {"date": date, "daily": 0.0, "weekly": 0.0, "monthly": 0.0})
+
+    for date, volume in daily.items():
+        row_for(date)["daily"] = volume
+
+    weeks = {get_week_start(date) for date in daily}
+    months = {get_month_start(date) for date in daily}
+    weekly = defaultdict(float)
+    monthly = defaultdict(float)
+    for date in sorted(rows):
+        if get_week_start(date) in weeks:
+            weekly[get_week_start(date)] += rows[date]["daily"]
+        if get_month_start(date) in months:
+            monthly[get_month_start(date)] += rows[date]["daily"]
+
+    for week in weeks:
+        row_for(week)["weekly"] = weekly[week]
+    for month in months:
+        row_for(month)["monthly"] = monthly[month]
+
+    changed = set(daily) | weeks | months
+    upsert_volume_rows([rows[date] for date in sorted(changed)], wallet)
+
+def save_volume_to_db(daily, weekly=None, monthly=None):
+    # weekly/monthly are derived from the stored daily rows, see save_daily_volume
+    save_daily_volume(daily)
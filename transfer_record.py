@@ -0,0 +1,82 @@
+import os
+import json
+import math
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ETH_ADDRESS = (os.getenv("ETH_ADDRESS") or "").lower() or None
+
+
+def loads(data):
+    """Decodes a JSON body (bytes or str), with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Compact JSON text, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def parse_timestamp(value):
+    """ISO 8601 blockTimestamp ("2025-01-01T00:00:00.000Z") as unix seconds, or None."""
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def parse_value(value_raw):
+    try:
+        return float(value_raw) if value_raw else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class TransferRecord:
+    """
+    The fields of an alchemy_getAssetTransfers transfer the volume pipeline reads:
+    block number, unix timestamp (None until resolved from the block), lowercase
+    token address (ETH_ADDRESS for native ETH) and decimal-adjusted value (NaN when invalid).
+    """
+
+    __slots__ = ("unique_id", "block", "timestamp", "token", "value")
+
+    def __init__(self, unique_id, block, timestamp, token, value):
+        self.unique_id = unique_id
+        self.block = block
+        self.timestamp = timestamp
+        self.token = token
+        self.value = value
+
+    @classmethod
+    def from_transfer(cls, tx):
+        if tx.get("asset") == "ETH":
+            token = ETH_ADDRESS
+        else:
+            token = ((tx.get("rawContract") or {}).get("address") or "").lower() or None
+        block_num = tx.get("blockNum")
+        return cls(
+            tx.get("uniqueId"),
+            int(block_num, 16) if block_num else None,
+            parse_timestamp((tx.get("metadata") or {}).get("blockTimestamp")),
+            token,
+            parse_value(tx.get("value")),
+        )
+
+    def __repr__(self):
+        return (f"TransferRecord(block={self.block}, timestamp={self.timestamp}, "
+                f"token={self.token!r}, value={self.value})")
+
+
+def project_page(transfers):
+    return [TransferRecord.from_transfer(tx) for tx in transfers]
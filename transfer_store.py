@@ -0,0 +1,360 @@
+import os
+import math
+import time
+import threading
+import alchemy
+import local_db
+import pipeline
+from transfer_record import TransferRecord, dumps
+from concurrent.futures import ThreadPoolExecutor
+from ttl_cache import SingleFlight
+
+# /api/wallet stores at most this many transfers per wallet and direction; larger wallets are analyzed live
+WALLET_STORE_MAX_TRANSFERS = int(os.getenv("WALLET_STORE_MAX_TRANSFERS", "20000"))
+# Seconds before a synced wallet is checked with Alchemy for newer transfers
+WALLET_SYNC_INTERVAL = int(os.getenv("WALLET_SYNC_INTERVAL", "60"))
+# Wallets synced in the background at once
+WALLET_SYNC_THREADS = int(os.getenv("WALLET_SYNC_THREADS", "2"))
+# Stored transfers read per query when iterating a wallet's history
+READ_PAGE_SIZE = int(os.getenv("TRANSFER_STORE_READ_PAGE_SIZE", "1000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transfers (
+    unique_id TEXT PRIMARY KEY,
+    block_num INTEGER NOT NULL,
+    from_address TEXT,
+    to_address TEXT,
+    token TEXT,
+    category TEXT,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transfers_to_block ON transfers (to_address, block_num);
+CREATE INDEX IF NOT EXISTS idx_transfers_from_block ON transfers (from_address, block_num);
+CREATE INDEX IF NOT EXISTS idx_transfers_token_block ON transfers (token, block_num);
+CREATE INDEX IF NOT EXISTS idx_transfers_block ON transfers (block_num);
+CREATE TABLE IF NOT EXISTS ingestion_cursors (
+    name TEXT PRIMARY KEY,
+    block_num INTEGER NOT NULL,
+    unique_id TEXT
+);
+"""
+
+# Columns added after the first release per table, with the SQL that fills existing rows
+ADDED_COLUMNS = {
+    "transfers": {
+        "value": ("REAL", "json_extract(raw, '$.value')"),
+        "asset": ("TEXT", "json_extract(raw, '$.asset')"),
+        "timestamp": ("INTEGER", "CAST(strftime('%s', json_extract(raw, '$.metadata.blockTimestamp')) AS INTEGER)"),
+    },
+    # When the cursor last reached the head; NULL while a first sync is still paging.
+    # Cursors from before are only written after a full sync, so they count as caught up long ago.
+    "ingestion_cursors": {
+        "synced_at": ("REAL", "0"),
+    },
+}
+
+DIRECTIONS = {"incoming": "toAddress", "outgoing": "fromAddress"}
+
+_initialized = set()
+sync_flights = SingleFlight()
+sync_pool = ThreadPoolExecutor(max_workers=WALLET_SYNC_THREADS, thread_name_prefix="wallet-sync")
+_syncing = set()
+_syncing_lock = threading.Lock()
+
+
+def migrate(conn):
+    with conn:
+        for table, added in ADDED_COLUMNS.items():
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, (column_type, expression) in added.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    conn.execute(f"UPDATE {table} SET {column} = {expression}")
+
+
+def get_connection():
+    conn = local_db.connect()
+    if id(conn) not in _initialized:
+        conn.executescript(SCHEMA)
+        migrate(conn)
+        _initialized.add(id(conn))
+    return conn
+
+
+def cursor_name(wallet, direction="incoming"):
+    return f"{direction}:{wallet.lower()}"
+
+
+def get_cursor(name):
+    """Returns (block_num, unique_id) of the last ingested transfer, or None."""
+    row = get_connection().execute(
+        "SELECT block_num, unique_id FROM ingestion_cursors WHERE name = ?", (name,)
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def transfer_row(tx):
+    record = TransferRecord.from_transfer(tx)
+    return (
+        record.unique_id,
+        record.block,
+        (tx.get("from") or "").lower(),
+        (tx.get("to") or "").lower(),
+        record.token,
+        tx.get("category"),
+        None if math.isnan(record.value) else record.value,
+        tx.get("asset"),
+        record.timestamp,
+        dumps(tx),
+    )
+
+
+def insert_rows(conn, rows):
+    """Inserts transfer_row() tuples, ignoring known uniqueIds. Returns (inserted, newest_row)."""
+    if not rows:
+        return 0, None
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT OR IGNORE INTO transfers "
+        "(unique_id, block_num, from_address, to_address, token, category, value, asset, timestamp, raw) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    return conn.total_changes - before, max(rows, key=lambda row: row[1])
+
+
+def insert_transfers(conn, transfers):
+    return insert_rows(conn, [transfer_row(tx) for tx in transfers])
+
+
+def advance_cursor(conn, cursor_name, newest_row):
+    conn.execute(
+        "INSERT INTO ingestion_cursors (name, block_num, unique_id) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET block_num = excluded.block_num, unique_id = excluded.unique_id "
+        "WHERE excluded.block_num >= ingestion_cursors.block_num",
+        (cursor_name, newest_row[1], newest_row[0]),
+    )
+
+
+def set_synced_at(conn, cursor_name, synced_at):
+    """Records when the cursor reached the head."""
+    conn.execute(
+        "INSERT INTO ingestion_cursors (name, block_num, synced_at) VALUES (?, 0, ?) "
+        "ON CONFLICT(name) DO UPDATE SET synced_at = excluded.synced_at",
+        (cursor_name, synced_at),
+    )
+
+
+def save_rows(cursor_name, rows):
+    """
+    Appends transfer rows to the store and advances the cursor in one transaction,
+    so a crash never leaves the cursor ahead of the stored rows.
+    Returns the number of newly stored transfers.
+    """
+    conn = get_connection()
+    with conn:
+        inserted, newest = insert_rows(conn, rows)
+        if newest is not None:
+            advance_cursor(conn, cursor_name, newest)
+        set_synced_at(conn, cursor_name, time.time())
+    return inserted
+
+
+def sync_incoming_transfers(wallet, shards=None, concurrency=None):
+    """
+    Fetches only the transfers to `wallet` mined at or after the cursor block and
+    appends them to the local store. The cursor block itself is re-requested so
+    nothing in it is missed; duplicates are dropped on uniqueId.
+
+    Unsharded syncs are streamed oldest first: each page is stored together with
+    the cursor advance while the next one is prefetched, so a sync that fails or
+    is killed resumes from the last stored page. With `max_transfers` the sync
+    stops once that many new transfers are stored, before reaching the head.
+    """
+    return sync_transfers(wallet, "incoming", shards, concurrency)
+
+
+def sync_transfers(wallet, direction, shards=None, concurrency=None, max_transfers=None):
+    """sync_incoming_transfers for either direction ("incoming" or "outgoing"), each with its own cursor."""
+    wallet = wallet.lower()
+    # Concurrent syncs of the same wallet (e.g. parallel backfill tasks) share one fetch
+    return sync_flights.do(
+        (wallet, direction), lambda: _sync_transfers(wallet, direction, shards, concurrency, max_transfers)
+    )
+
+
+def _sync_transfers(wallet, direction, shards, concurrency, max_transfers=None):
+    name = cursor_name(wallet, direction)
+    cursor = get_cursor(name)
+    from_block = hex(cursor[0]) if cursor else "0x0"
+
+    if max_transfers is None and (shards or alchemy.ALCHEMY_FETCH_SHARDS) > 1:
+        # Each page is reduced to its row as it arrives rather than kept as decoded JSON
+        rows = alchemy.fetch_all_transfers(
+            wallet, from_block=from_block, shards=shards, concurrency=concurrency, direction=DIRECTIONS[direction],
+            project=transfer_row,
+        )
+        inserted = save_rows(name, rows)
+    else:
+        inserted = 0
+        conn = get_connection()
+        pages = pipeline.prefetch(alchemy.iter_transfer_pages(
+            wallet, from_block, direction=DIRECTIONS[direction], order="asc"
+        ))
+        try:
+            for page in pages:
+                with conn:
+                    page_inserted, page_newest = insert_transfers(conn, page)
+                    if page_newest is not None:
+                        advance_cursor(conn, name, page_newest)
+                inserted += page_inserted
+                if max_transfers is not None and inserted >= max_transfers:
+                    break
+            else:
+                with conn:
+                    set_synced_at(conn, name, time.time())
+        finally:
+            pages.close()
+
+    print(f"Synced {inserted} new {direction} transfers for {wallet} from block {from_block}.")
+    return inserted
+
+
+def sync_state(conn, wallet, direction):
+    """(synced_at, stored) for one direction of `wallet`; synced_at is None until it reached the head."""
+    row = conn.execute(
+        "SELECT synced_at FROM ingestion_cursors WHERE name = ?", (cursor_name(wallet, direction),)
+    ).fetchone()
+    address_field = "to_address" if direction == "incoming" else "from_address"
+    stored = conn.execute(f"SELECT COUNT(*) FROM transfers WHERE {address_field} = ?", (wallet,)).fetchone()[0]
+    return (row[0] if row else None), stored
+
+
+def wallet_store_status(wallet):
+    """
+    Whether /api/wallet can answer `wallet` from the store: "ready" when both
+    directions have reached the head, "too_large" when a first sync stopped at
+    WALLET_STORE_MAX_TRANSFERS, else "syncing". Anything but "too_large" queues
+    a background sync when one is due.
+    """
+    wallet = wallet.lower()
+    conn = get_connection()
+    now = time.time()
+    status = "ready"
+    due = False
+    for direction in DIRECTIONS:
+        synced_at, stored = sync_state(conn, wallet, direction)
+        if synced_at is None:
+            if stored >= WALLET_STORE_MAX_TRANSFERS:
+                return "too_large"
+            status = "syncing"
+        due = due or synced_at is None or now - synced_at >= WALLET_SYNC_INTERVAL
+    if due:
+        sync_wallet_in_background(wallet)
+    return status
+
+
+def sync_wallet_in_background(wallet):
+    """Queues a sync of both directions of `wallet` unless one is already queued in this process."""
+    with _syncing_lock:
+        if wallet in _syncing:
+            return
+        _syncing.add(wallet)
+    sync_pool.submit(_sync_wallet, wallet)
+
+
+def _sync_wallet(wallet):
+    conn = get_connection()
+    try:
+        for direction in DIRECTIONS:
+            synced_at, stored = sync_state(conn, wallet, direction)
+            # Only the first sync is capped; after that a wallet grows with its own activity
+            max_transfers = None if synced_at is not None else WALLET_STORE_MAX_TRANSFERS - stored
+            if max_transfers is not None and max_transfers <= 0:
+                continue
+            sync_transfers(wallet, direction, shards=1, max_transfers=max_transfers)
+    except Exception as e:
+        print(f"Error syncing transfers for {wallet}: {e}")
+    finally:
+        with _syncing_lock:
+            _syncing.discard(wallet)
+
+
+def iter_incoming_transfers(wallet, from_block=0, to_block=None):
+    """
+    Yields stored transfers to `wallet` mined in [from_block, to_block] as
+    TransferRecords, newest first, matching Alchemy's `order: desc`. Read from
+    the indexed columns; the raw JSON is not decoded.
+
+    Rows are read READ_PAGE_SIZE at a time and each query runs to completion
+    before its rows are yielded. An open SELECT would pin the connection's read
+    snapshot while the consumer writes on the same per-thread connection (e.g.
+    block anchors), and such writes fail with "database is locked" once another
+    thread has committed.
+    """
+    conn = get_connection()
+    wallet = wallet.lower()
+    last = (2 ** 63 - 1 if to_block is None else to_block, 2 ** 63 - 1)
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, unique_id, block_num, timestamp, token, value FROM transfers "
+            "WHERE to_address = ? AND block_num >= ? AND (block_num, rowid) < (?, ?) "
+            "ORDER BY block_num DESC, rowid DESC LIMIT ?",
+            (wallet, from_block, *last, READ_PAGE_SIZE),
+        ).fetchall()
+        for _, unique_id, block_num, timestamp, token, value in rows:
+            yield TransferRecord(unique_id, block_num, timestamp, token, math.nan if value is None else value)
+        if len(rows) < READ_PAGE_SIZE:
+            return
+        last = (rows[-1][2], rows[-1][0])
+
+
+def analyze_wallet_history(wallet, start_ts=None, end_ts=None):
+    """
+    analyze_wallet over the wallet's stored history: the top alchemy.WALLET_TOP_K
+    counterparties, their sent/received counts and per-token totals come from
+    indexed queries. Nothing is fetched; see wallet_store_status.
+    """
+    wallet = wallet.lower()
+    from_block, to_block = alchemy.get_block_range(start_ts, end_ts)
+    block_range = (int(from_block, 16), int(to_block, 16) if to_block != "latest" else 2 ** 63 - 1)
+    # Same transfers as the live path: ERC-20 only, self-transfers on both sides
+    directed = """
+        SELECT to_address AS peer, token, asset, value, 1 AS sent, 0 AS received FROM transfers
+        WHERE from_address = ? AND block_num BETWEEN ? AND ? AND category = 'erc20'
+        UNION ALL
+        SELECT from_address AS peer, token, asset, value, 0 AS sent, 1 AS received FROM transfers
+        WHERE to_address = ? AND block_num BETWEEN ? AND ? AND category = 'erc20'
+    """
+    params = (wallet, *block_range, wallet, *block_range)
+    conn = get_connection()
+    peers = conn.execute(
+        f"SELECT peer, SUM(sent), SUM(received) FROM ({directed}) "
+        "GROUP BY peer ORDER BY SUM(sent) + SUM(received) DESC, peer LIMIT ?",
+        (*params, alchemy.WALLET_TOP_K),
+    ).fetchall()
+
+    tokens = {peer: {} for peer, _, _ in peers}
+    if peers:
+        placeholders = ", ".join("?" for _ in peers)
+        rows = conn.execute(
+            f"SELECT peer, token, MAX(asset), SUM(value * sent), SUM(value * received) FROM ({directed}) "
+            f"WHERE peer IN ({placeholders}) GROUP BY peer, token",
+            (*params, *tokens),
+        )
+        for peer, token, asset, sent, received in rows:
+            tokens[peer][token] = {"asset": asset, "sent": sent or 0.0, "received": received or 0.0}
+
+    labels = alchemy.label_many([peer for peer, _, _ in peers])
+    result = []
+    for (peer, sent, received), label in zip(peers, labels):
+        result.append({
+            "counterparty": peer,
+            "tx_count": sent + received,
+            "sent": sent,
+            "received": received,
+            "tokens": tokens[peer],
+            "type": "protocol/cex" if label != "Unknown" else "wallet",
+            "label": label
+        })
+    return result
@@ -1,14 +1,32 @@
 from collections import defaultdict
+from itertools import chain
 from datetime import datetime, timedelta, date, timezone
+import numpy as np
+import pandas as pd
 import aerodrome as aerodrome
 import alchemy
+import block_index
+import coingecko
+import pipeline
+import price_store
 import os
-import supabase_client  # pip install python-dateutil
+import logging
+import metrics
+import supabase_client
+import transfer_store
+from transfer_record import project_page
 
-MASTER_WALLET = os.getenv("MASTER_WALLET").lower()
-ETH_ADDRESS = os.getenv("ETH_ADDRESS")
+log = logging.getLogger("usd_volume_analysis")
+
+MASTER_WALLET = (os.getenv("MASTER_WALLET") or "").lower()
 
 SECONDS_IN_DAY = 86400
+# Transfers per page whose decimals/timestamps are resolved in one batch
+PAGE_SIZE = 100
+# "store": sync the local transfer store and read from it; "stream": page straight from Alchemy
+VOLUME_SOURCE = os.getenv("VOLUME_SOURCE", "store")
+# "coingecko": price tokens the subgraph has no price for at their current CoinGecko price; "none": count them as 0
+PRICE_FALLBACK = os.getenv("PRICE_FALLBACK", "none")
 
 STABLECOINS = {
     "0x833589fcd6edb6e08f4c7c32d4f71b54bda02913": 1.0,  # USDC (Base)
@@ -23,79 +41,99 @@ def get_week_start(dt):
     monday_midnight = monday.replace(hour=0, minute=0, second=0, microsecond=0)
     return int(monday_midnight.timestamp())
 
-def parse_transfer_timestamp(tx):
-    from dateutil import parser
-
-    ts = tx.get("metadata", {}).get("blockTimestamp")
-    if ts:
-        try:
-            dt = parser.isoparse(ts)
-            ts_unix = int(dt.timestamp())
-            return dt, ts_unix
-        except Exception as e:
-            print(f"Failed to parse ISO timestamp '{ts}': {e}")
-            return None, None
+def get_transfer_timestamp(record):
+    """Unix timestamp of a TransferRecord, from the block index when the transfer had none."""
+    if record.timestamp is not None:
+        return record.timestamp
+    if record.block is None:
+        metrics.log_sampled(log, logging.WARNING, "No timestamp or blockNum in transfer")
+        return None
+    ts_unix = block_index.get_index().get_timestamp(record.block)
+    if ts_unix is None:
+        metrics.log_sampled(log, logging.WARNING, "No block timestamp from alchemy for block %s", record.block)
+    return ts_unix
+
+def prefetch_prices(records):
+    """Loads day prices for every non-stablecoin token in the page in bulk."""
+    tokens = {record.token for record in records if record.token and record.token not in STABLECOINS}
+    if not tokens:
+        return
+    if price_store.PRICE_SOURCE == "store":
+        price_store.get_store().refresh({aerodrome.normalize_token_address(token) for token in tokens})
     else:
-        block_num_hex = tx.get("blockNum")
-        if block_num_hex:
-            ts_unix = alchemy.get_block_timestamp_from_alchemy(block_num_hex)
-            if ts_unix is not None:
-                dt = datetime.fromtimestamp(ts_unix)
-                return dt, ts_unix
-            else:
-                print("No block timestamp from alchemy for blockNum:", block_num_hex)
-        else:
-            print("No timestamp or blockNum in transfer")
-        return None, None
+        aerodrome.fetch_token_day_data_many(tokens, 150)
 
-def get_token_price(token_address, ts_unix):
+def get_day_price(token_address, ts_unix):
     token_address = token_address.lower()
     if token_address in STABLECOINS:
         return STABLECOINS[token_address]
+    elif price_store.PRICE_SOURCE == "store":
+        return price_store.get_store().price_at(aerodrome.normalize_token_address(token_address), ts_unix)
     else:
         return aerodrome.get_token_price_at(ts_unix, token_address, 150)
 
-def process_transfer(tx, index, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts):
-    dt, ts_unix = parse_transfer_timestamp(tx)
-    if dt is None or ts_unix is None:
-        print(f"Transfer {index}: Missing or invalid timestamp, skipping.")
-        return True  # continue processing
+def get_day_prices(tokens, days):
+    """get_day_price for arrays of tokens and days, as one as-of join per token with PRICE_SOURCE=store."""
+    if price_store.PRICE_SOURCE != "store":
+        return np.array([get_day_price(token, day) for token, day in zip(tokens, days)], dtype=float)
+    tokens = pd.Series(tokens, dtype=object)
+    stable = tokens.map(STABLECOINS)
+    prices = stable.to_numpy(dtype=float, na_value=0.0)
+    rest = stable.isna().to_numpy()
+    if rest.any():
+        contracts = tokens[rest].map(aerodrome.normalize_token_address)
+        prices[rest] = price_store.get_store().prices_asof(contracts.to_numpy(), np.asarray(days)[rest])
+    return prices
+
+def get_fallback_prices(token_addresses):
+    """Current CoinGecko prices for tokens without a subgraph price, fetched in bulk (PRICE_FALLBACK=coingecko)."""
+    if PRICE_FALLBACK != "coingecko":
+        return {}
+    # Native ETH has no contract; CoinGecko knows it as WETH on Base
+    contracts = {token: aerodrome.normalize_token_address(token) for token in token_addresses}
+    prices = coingecko.get_current_token_usd_prices(contracts.values())
+    return {token: prices.get(contract, 0.0) for token, contract in contracts.items()}
+
+def get_token_price(token_address, ts_unix):
+    price = get_day_price(token_address, ts_unix)
+    if price == 0:
+        price = get_fallback_prices([token_address.lower()]).get(token_address.lower(), 0.0)
+    return price
+
+def skip_transfer(index, reason, detail=""):
+    metrics.transfers_skipped_total.inc(reason=reason)
+    metrics.log_sampled(log, logging.INFO, "Transfer %s: %s%s, skipping.", index, reason, detail)
+    return True  # continue processing
+
+def process_transfer(record, index, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts):
+    ts_unix = get_transfer_timestamp(record)
+    if ts_unix is None:
+        return skip_transfer(index, "missing_timestamp")
+    dt = datetime.fromtimestamp(ts_unix, timezone.utc)
 
     if not start_ts <= ts_unix < end_ts:
-        print(f"Transfer {index}: Date {dt.date()} outside target range, stopping.")
+        log.debug("Transfer %s: Date %s outside target range, stopping.", index, dt.date())
         return False  # signal to stop further processing
 
-    token_address = tx.get("rawContract", {}).get("address")
-    if tx.get("asset") == "ETH":
-        token_address = ETH_ADDRESS
+    token_address = record.token
     if not token_address:
-        print(f"Transfer {index}: Missing token address, skipping.")
-        return True  # continue processing
+        return skip_transfer(index, "missing_token")
 
-    token_address = token_address.lower()
-    value_raw = tx.get("value")
-    if not value_raw:
-        print(f"Transfer {index}: Missing value, skipping.")
-        return True  # continue processing
-
-    try:
-        value = float(value_raw)
-    except Exception as e:
-        print(f"Transfer {index}: Invalid value '{value_raw}', skipping. Error: {e}")
-        return True  # continue processing
+    value = record.value
+    if np.isnan(value):
+        return skip_transfer(index, "invalid_value")
 
     if value == 0:
-        print(f"Transfer {index}: Value zero, skipping.")
-        return True  # continue processing
+        return skip_transfer(index, "zero_value")
 
     decimals = alchemy.get_token_decimals(token_address)  # preserved call, though unused here
 
-    price = get_token_price(token_address, ts_unix)
-    print(f"Transfer {index}: Token {token_address} on {dt.date()} price = {price}")
+    with metrics.pipeline_stage_seconds.time(stage="pricing"):
+        price = get_token_price(token_address, ts_unix)
+    log.debug("Transfer %s: Token %s on %s price = %s", index, token_address, dt.date(), price)
 
     if price == 0:
-        print(f"Transfer {index}: Price zero, skipping.")
-        return True  # continue processing
+        return skip_transfer(index, "zero_price")
 
     usd_value = value * price
 
@@ -108,9 +146,84 @@ def process_transfer(tx, index, daily_volume, weekly_volume, monthly_volume, sta
     weekly_volume[week_start] += usd_value
     monthly_volume[month_start] += usd_value
 
-    print(f"Transfer {index}: Added USD {usd_value} to daily volume on {dt.date()}.")
+    metrics.transfers_processed_total.inc()
+    log.debug("Transfer %s: Added USD %s to daily volume on %s.", index, usd_value, dt.date())
     return True  # processed successfully
 
+def iter_pages(transfers, size=PAGE_SIZE):
+    page = []
+    for tx in transfers:
+        page.append(tx)
+        if len(page) == size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def get_day_range(target_date):
+    """[start_ts, end_ts) of the UTC day target_date."""
+    start_ts = int(datetime(target_date.year, target_date.month, target_date.day, tzinfo=timezone.utc).timestamp())
+    return start_ts, start_ts + SECONDS_IN_DAY
+
+def transfer_pages_in_range(pages, start_ts, end_ts):
+    """
+    Filters newest-first pages to [start_ts, end_ts): transfers newer than end_ts
+    are dropped and no further page is pulled once one lies entirely before start_ts.
+    """
+    try:
+        for page in pages:
+            # Only timestamps that came with the transfers; no RPC to resolve the rest
+            known = [record.timestamp for record in page if record.timestamp is not None]
+            if known and max(known) < start_ts:
+                # Keep the page so the aggregation sees where the range ends
+                yield page
+                return
+            page = [record for record in page if record.timestamp is None or record.timestamp < end_ts]
+            if page:
+                yield page
+    finally:
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+
+def open_transfer_pages(start_ts, end_ts, shards=None, concurrency=None, wallet=None):
+    """
+    Pages of `wallet` (default MASTER_WALLET) transfers in [start_ts, end_ts) as
+    TransferRecords, newest first, from VOLUME_SOURCE.
+    """
+    wallet = (wallet or MASTER_WALLET).lower()
+    if VOLUME_SOURCE == "stream":
+        # The next Alchemy page is fetched and projected while the current one is priced and aggregated
+        pages = pipeline.prefetch(map(project_page, alchemy.iter_transfer_pages(
+            wallet, start_ts=start_ts, end_ts=end_ts
+        )))
+    else:
+        # Only blocks after the stored cursor are requested from Alchemy
+        transfer_store.sync_incoming_transfers(wallet, shards=shards, concurrency=concurrency)
+        # Only the blocks of the range are read back, not the whole history down to start_ts
+        from_block, to_block = alchemy.get_block_range(start_ts, end_ts)
+        pages = iter_pages(transfer_store.iter_incoming_transfers(
+            wallet, int(from_block, 16), None if to_block == "latest" else int(to_block, 16)
+        ))
+    return transfer_pages_in_range(pages, start_ts, end_ts)
+
+def prefetch_page(page):
+    with metrics.pipeline_stage_seconds.time(stage="metadata"):
+        alchemy.prefetch_transfer_metadata(page)
+    with metrics.pipeline_stage_seconds.time(stage="prices"):
+        prefetch_prices(page)
+
+def process_transfers(transfers, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts):
+    index = 0
+    for page in metrics.timed_iter(iter_pages(transfers), "fetch"):
+        prefetch_page(page)
+        for record in page:
+            index += 1
+            should_continue = process_transfer(record, index, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts)
+            if not should_continue:
+                log.info("Stopping at transfer %s due to date out of range.", index)
+                return
+
 def aggregate_usd_volume_backfill(transfers, start_ts, end_ts):
     daily_volume = defaultdict(float)
     weekly_volume = defaultdict(float)
@@ -121,11 +234,7 @@ def aggregate_usd_volume_backfill(transfers, start_ts, end_ts):
     def date_check(ts_unix):
         return start_ts <= ts_unix < end_ts
 
-    for i, tx in enumerate(transfers, 1):
-        should_continue = process_transfer(tx, i, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts)
-        if not should_continue:
-            print(f"Stopping at transfer {i} due to date out of range.")
-            break
+    process_transfers(transfers, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts)
 
     print("\nSample Daily USD Volume:")
     for day_start, vol in sorted(daily_volume.items())[:10]:
@@ -133,6 +242,91 @@ def aggregate_usd_volume_backfill(transfers, start_ts, end_ts):
 
     return daily_volume, weekly_volume, monthly_volume
 
+def load_transfer_frame(page):
+    """Loads a page of TransferRecords into columns: ts (unix seconds), token, value."""
+    ts = np.array([get_transfer_timestamp(record) for record in page], dtype=float)
+    return pd.DataFrame({
+        "ts": ts,
+        "token": [record.token for record in page],
+        "value": np.array([record.value for record in page], dtype=float),
+    })
+
+def sum_by_bucket(buckets, usd_values):
+    """Sums usd_values per bucket in input order, so totals equal sequential += accumulation."""
+    volume = defaultdict(float)
+    if len(buckets) == 0:
+        return volume
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    sums = np.zeros(len(keys))
+    np.add.at(sums, inverse, usd_values)
+    for key, total in zip(keys.tolist(), sums.tolist()):
+        volume[key] = total
+    return volume
+
+def aggregate_usd_volume_vectorized(transfers, start_ts, end_ts):
+    """
+    Columnar equivalent of aggregate_usd_volume_backfill: same skip/stop rules
+    and the same daily, weekly (Monday) and monthly UTC buckets.
+    """
+    frames = []
+    for page in metrics.timed_iter(iter_pages(transfers), "fetch"):
+        prefetch_page(page)
+        with metrics.pipeline_stage_seconds.time(stage="parse"):
+            frame = load_transfer_frame(page)
+
+        # Transfers are newest first: stop at the first timestamp outside the range
+        ts = frame["ts"]
+        outside = ts.notna() & ~((ts >= start_ts) & (ts < end_ts))
+        if outside.any():
+            frames.append(frame.iloc[:int(np.argmax(outside.to_numpy()))])
+            break
+        frames.append(frame)
+
+    if not frames:
+        return defaultdict(float), defaultdict(float), defaultdict(float)
+    frame = pd.concat(frames, ignore_index=True)
+    # Same order of checks as process_transfer, so each transfer counts under one reason
+    remaining = pd.Series(True, index=frame.index)
+    for reason, invalid in (
+        ("missing_timestamp", frame["ts"].isna()),
+        ("missing_token", frame["token"].isna()),
+        ("invalid_value", frame["value"].isna()),
+        ("zero_value", frame["value"] == 0),
+    ):
+        skipped = remaining & invalid
+        if skipped.any():
+            metrics.transfers_skipped_total.inc(int(skipped.sum()), reason=reason)
+        remaining &= ~invalid
+    frame = frame[remaining]
+    ts = frame["ts"].to_numpy(dtype=np.int64)
+    frame = frame.assign(ts=ts, day=ts - ts % SECONDS_IN_DAY)
+
+    # Price once per distinct (token, day), then join back onto the transfers
+    with metrics.pipeline_stage_seconds.time(stage="pricing"):
+        prices = frame[["token", "day"]].drop_duplicates()
+        prices["price"] = get_day_prices(prices["token"].to_numpy(), prices["day"].to_numpy())
+        unpriced = prices["price"] == 0
+        if unpriced.any() and PRICE_FALLBACK == "coingecko":
+            fallback = get_fallback_prices(prices.loc[unpriced, "token"].unique().tolist())
+            prices.loc[unpriced, "price"] = prices.loc[unpriced, "token"].map(fallback).fillna(0.0)
+    frame = frame.merge(prices, on=["token", "day"], how="left")
+    zero_price = frame["price"] == 0
+    if zero_price.any():
+        metrics.transfers_skipped_total.inc(int(zero_price.sum()), reason="zero_price")
+    frame = frame[~zero_price]
+    metrics.transfers_processed_total.inc(len(frame))
+
+    usd_values = (frame["value"] * frame["price"]).to_numpy(dtype=float)
+    day = frame["day"].to_numpy(dtype=np.int64)
+    # 1970-01-01 was a Thursday, so Monday-based weekday is (days + 3) % 7
+    week = day - ((day // SECONDS_IN_DAY + 3) % 7) * SECONDS_IN_DAY
+    month = day.astype("datetime64[s]").astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+
+    print(f"Aggregated {len(frame)} priced transfers between {datetime.fromtimestamp(start_ts, tz=timezone.utc).date()} and {datetime.fromtimestamp(end_ts, tz=timezone.utc).date()}")
+
+    with metrics.pipeline_stage_seconds.time(stage="aggregate"):
+        return sum_by_bucket(day, usd_values), sum_by_bucket(week, usd_values), sum_by_bucket(month, usd_values)
+
 def aggregate_usd_volume_single_day(transfers, target_date):
     """
     target_date: datetime.date instance representing the single day to aggregate
@@ -144,15 +338,9 @@ def aggregate_usd_volume_single_day(transfers, target_date):
     print(f"Aggregating volume for single day: {target_date}")
 
     # Calculate start and end timestamps for the day
-    start_dt = datetime(target_date.year, target_date.month, target_date.day)
-    start_ts = int(start_dt.timestamp())
-    end_ts = start_ts + SECONDS_IN_DAY
-
-    for i, tx in enumerate(transfers, 1):
-        should_continue = process_transfer(tx, i, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts)
-        if not should_continue:
-            print(f"Stopping at transfer {i} due to date out of range.")
-            break
+    start_ts, end_ts = get_day_range(target_date)
+
+    process_transfers(transfers, daily_volume, weekly_volume, monthly_volume, start_ts, end_ts)
 
     print("\nDaily USD Volume for", target_date)
     for day_start, vol in sorted(daily_volume.items()):
@@ -161,27 +349,51 @@ def aggregate_usd_volume_single_day(transfers, target_date):
     return daily_volume, weekly_volume, monthly_volume
 
 
-def run_backfill():
-    transfers = alchemy.fetch_all_incoming_transfers(MASTER_WALLET)
-
+def run_backfill(shards=None, concurrency=None):
     start_2025 = int(datetime(2025, 1, 1).timestamp())
     end_2025 = int(datetime(2026, 1, 1).timestamp())
-    daily_volume, weekly_volume, monthly_volume = aggregate_usd_volume_backfill(transfers, start_2025, end_2025)
+
+    # Shard count/concurrency default to ALCHEMY_FETCH_SHARDS/ALCHEMY_FETCH_CONCURRENCY.
+    # Every day of the year is written, 0 without volume, so a re-run overwrites instead of leaving stale days
+    daily_volume = aggregate_daily_volume(start_2025, end_2025, shards=shards, concurrency=concurrency)
 
     print("Reached here after backfill")
 
-    supabase_client.save_volume_to_db(daily_volume, weekly_volume, monthly_volume)
+    supabase_client.save_daily_volume(daily_volume)
 
 def run_single_day(target_day=None):
-    transfers = alchemy.fetch_all_incoming_transfers(MASTER_WALLET)
-
     if target_day is None:
         target_day = date.today()  # Default to today if no date given
 
-    daily_volume, weekly_volume, monthly_volume = aggregate_usd_volume_single_day(transfers, target_day)
+    start_ts, end_ts = get_day_range(target_day)
+    pages = open_transfer_pages(start_ts, end_ts)
+    try:
+        daily_volume, weekly_volume, monthly_volume = aggregate_usd_volume_single_day(chain.from_iterable(pages), target_day)
+    finally:
+        pages.close()
+
+    # Always write the target day so a re-run overwrites it, even with no volume
+    supabase_client.save_daily_volume({start_ts: daily_volume.get(start_ts, 0.0)})
+
+def aggregate_daily_volume(start_ts, end_ts, wallet=None, shards=None, concurrency=None):
+    """Daily USD volume of `wallet` (default MASTER_WALLET) for every UTC day in [start_ts, end_ts), 0 when empty."""
+    pages = open_transfer_pages(start_ts, end_ts, shards=shards, concurrency=concurrency, wallet=wallet)
+    try:
+        daily_volume, weekly_volume, monthly_volume = aggregate_usd_volume_vectorized(chain.from_iterable(pages), start_ts, end_ts)
+    finally:
+        pages.close()
+
+    days = range(start_ts - start_ts % SECONDS_IN_DAY, end_ts, SECONDS_IN_DAY)
+    return {day: daily_volume.get(day, 0.0) for day in days}
 
-    supabase_client.save_volume_to_db(daily_volume, weekly_volume, monthly_volume)
+def run_range(start_ts, end_ts):
+    """
+    Aggregates and upserts every UTC day in [start_ts, end_ts). Days without
+    volume are written as 0, so re-running a range is idempotent.
+    """
+    supabase_client.save_daily_volume(aggregate_daily_volume(start_ts, end_ts))
 
 
 if __name__ == "__main__":
+    metrics.configure_logging()
     run_single_day()